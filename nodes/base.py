@@ -1,3 +1,6 @@
+import copy
+import threading
+from collections import MutableMapping
 from .utils import import_path
 from . import settings as msettings
 
@@ -24,20 +27,28 @@ class Registry(object):
         self.modifiers = {}
         self.discovered = False
         self._processor = None
+        self._preparing = None
+        self._lock = threading.RLock()
 
     @property
     def processor(self):
         if not self._processor:
-            processor = import_path(msettings.PROCESSOR)
-            self._processor = processor(self)
-            self.autodiscover() # also autodiscover once
-
-            # prepare and check settings correctness
-            try:
-                self._processor.prepare_menus_settings()
-            except:
-                self._processor = None
-                raise
+            with self._lock:
+                # nested access (while autodiscover) gets unprepared one
+                if not self._processor and self._preparing:
+                    return self._preparing
+                if not self._processor:
+                    processor = import_path(msettings.PROCESSOR)(self)
+                    self._preparing = processor
+                    try:
+                        self.autodiscover() # also autodiscover once
+
+                        # prepare and check settings correctness, processor
+                        # is available for other threads only after it
+                        processor.prepare_menus_settings()
+                    finally:
+                        self._preparing = None
+                    self._processor = processor
 
         return self._processor
 
@@ -63,6 +74,29 @@ class Registry(object):
                    % menu.namespace)
         self.menus[menu.namespace] = menu
 
+    def register_signals(self, menu, *models):
+        """
+        Link menu (class or namespace) to models: saved or deleted instance
+        of any model schedules background rebuild of menuconfs with menu
+        (after transaction commit, see utils.rebuild).
+        """
+        from django.db import transaction
+        from django.db.models.signals import post_save, post_delete
+
+        namespace = (menu if isinstance(menu, basestring) else
+                     menu.namespace or menu.__name__)
+
+        def handler(sender, **kwargs):
+            transaction.on_commit(
+                lambda: self.processor.schedule_rebuild(namespace))
+
+        for model in models:
+            for signal in (post_save, post_delete,):
+                signal.connect(handler, sender=model, weak=False,
+                               dispatch_uid='nodes_%s_%s_%s' % (
+                                   namespace, model._meta.label,
+                                   id(signal),))
+
     def register_modifier(self, modifier):
         assert issubclass(modifier, Modifier)
         if modifier.__name__ in self.modifiers:
@@ -80,6 +114,29 @@ class Registry(object):
         self.modifiers = {}
 
 
+class MenuConf(dict):
+    """
+    Compiled read-only menuconf value (see Processor.compile_menus),
+    it is shared by all requests (threads), so dict() copy should be
+    used for any changes.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Menus menuconf value is read-only.')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
 # menus classes
 class Menu(object):
     """blank menu class"""
@@ -99,10 +156,35 @@ class Menu(object):
         """should return a list of NavigationNode instances"""
         raise NotImplementedError
 
+    def get_labels(self, request):
+        """
+        Translated fields of menu nodes in current language, used only by
+        menuconfs with LABELS option (nodes structure is built once in
+        default language): {node.id or (namespace, node.id): {"title": ...,
+        "url": ..., "data": {"meta_title": ..., ...}}}, any key is optional.
+        """
+        return {}
+
 
 class Modifier(object):
     """blank modifier class"""
     modify_event = None # ONCE, PER_REQUEST, POST_SELECT, DEFAULT
+    mutates = True  # DEFAULT modify changes nodes (tree or nodes values),
+                    # if not, readonly get_nodes does not clone nodes for it
+
+    def mutating(self, kwargs):
+        """Check that DEFAULT modify with get_nodes kwargs changes nodes."""
+        return self.mutates
+
+    def modified_descendants(self, meta, roots=None):
+        """
+        Mark meta "modified_descendants": True or set of root nodes indexes
+        with modified descendants if roots are known (by all modifiers).
+        """
+        value = meta['modified_descendants']
+        meta['modified_descendants'] = (
+            True if roots is None or value is True else
+            set(roots) | (value or set()))
 
     def modify(self, request, data, meta, **kwargs):
         """
@@ -126,6 +208,8 @@ class NavigationNode(object):
     children = None
     id = None   # only for processor.build_nodes method,
                 # should be unique within each Menu data definition
+    index = None  # position in pre-order list, set by processor after ONCE
+    fingerprint = None  # built subtree content hash, set by processor
 
     visible = True
     selected = False
@@ -149,10 +233,181 @@ class NavigationNode(object):
         return False
 
 
+class ClonedPaths(MutableMapping):
+    """
+    Paths of nodes copy: shared paths values (source nodes) are resolved
+    to nodes of copy by their indexes, first change makes own paths dict.
+    """
+
+    def __init__(self, paths, index):
+        self.paths, self.index = paths, index
+
+    def resolve(self, node):
+        if self.index is None or node is None or node.index is None:
+            return node
+        return self.index[node.index]
+
+    def own(self):
+        if self.index is not None:
+            self.paths, self.index = dict(self.items()), None
+        return self.paths
+
+    def __getitem__(self, key):
+        return self.resolve(self.paths[key])
+
+    def __setitem__(self, key, value):
+        self.own()[key] = value
+
+    def __delitem__(self, key):
+        del self.own()[key]
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __reduce__(self):
+        return (dict, (dict(self.items()),))
+
+
+class NodesState(object):
+    """
+    Per-request nodes state overlay.
+    Holds request related values (selection, positional marks, jump urls
+    and hidden nodes) by node.index, so ONCE nodes tree is never modified
+    after caching and can be shared between requests.
+    """
+
+    def __init__(self):
+        self.selected = None
+        self.hidden = set()
+        self.urls = {}
+
+        # positional marks (if marked is True, see PositionalMarker):
+        # ancestors of selected node and ONCE nodes index for lazy marks
+        self.marked = False
+        self.index = None
+        self.ancestors = set()
+
+    def __deepcopy__(self, memo):
+        # ONCE nodes index is not copied (marks are computed by it)
+        state = memo[id(self)] = copy.copy(self)
+        state.hidden, state.urls = set(self.hidden), dict(self.urls)
+        state.ancestors = set(self.ancestors)
+        return state
+
+    # positional marks by node index
+    def is_leaf(self, index):
+        return self.marked and not self.has_children(self.index[index])
+
+    def is_sibling(self, index):
+        selected = self.selected
+        return (self.marked and selected is not None and index != selected
+                and self.index[index].parent is self.index[selected].parent)
+
+    def is_ancestor(self, index):
+        return index in self.ancestors
+
+    def is_descendant(self, index):
+        selected = self.selected
+        if not self.marked or selected is None:
+            return False
+        node = self.index[index].parent
+        while node is not None:
+            if node.index == selected:
+                return True
+            node = node.parent
+        return False
+
+    def get_url(self, node):
+        return self.urls.get(node.index, node.url)
+
+    def get_root(self, node):
+        """Get root of node or None if node or any its ancestor is hidden."""
+        hidden = self.hidden
+        while True:
+            if node.index in hidden:
+                return None
+            if node.parent is None:
+                return node
+            node = node.parent
+
+    def children(self, node):
+        hidden = self.hidden
+        return ([i for i in node.children if i.index not in hidden]
+                if hidden else node.children)
+
+    def has_children(self, node):
+        """Check that node has not hidden children (lazy ones not loaded)."""
+        children, hidden = node.children, self.hidden
+        if not hidden or not children:
+            return bool(children)
+        visible = getattr(children, 'visible', None)
+        if visible is not None:
+            return visible(hidden)
+        return any(i.index not in hidden for i in children)
+
+    def wrap(self, nodes):
+        return [NodeProxy(i, self) for i in nodes
+                if i.index not in self.hidden]
+
+
+class NodeProxy(object):
+    """Lightweight read-only node wrapper with per-request state values."""
+    __slots__ = ('node', 'state',)
+
+    def __init__(self, node, state):
+        self.node = node
+        self.state = state
+
+    def __getattr__(self, name):
+        return getattr(self.node, name)
+
+    def __repr__(self):
+        return u'<Navigation Node Proxy: %s>' % self.node.title
+
+    @property
+    def url(self):
+        return self.state.get_url(self.node)
+
+    @property
+    def children(self):
+        return self.state.wrap(self.node.children)
+
+    @property
+    def parent(self):
+        parent = self.node.parent
+        return parent and NodeProxy(parent, self.state)
+
+    @property
+    def selected(self):
+        return (self.node.index is not None and
+                self.node.index == self.state.selected)
+
+    @property
+    def leaf(self):
+        return self.state.is_leaf(self.node.index)
+
+    @property
+    def sibling(self):
+        return self.state.is_sibling(self.node.index)
+
+    @property
+    def ancestor(self):
+        return self.state.is_ancestor(self.node.index)
+
+    @property
+    def descendant(self):
+        return self.state.is_descendant(self.node.index)
+
+
 class MetaData(object):
     selected = None
     chain = None
     title = None
+    preloaded = False  # filled by selection index (see load_selection)
+    trace = None  # processing trace (see middleware.MenusTraceMiddleware)
 
     def __init__(self):
         self.chain = []
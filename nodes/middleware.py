@@ -0,0 +1,31 @@
+from django.conf import settings
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+from .utils import add_nodes_to_request
+from .utils.trace import Trace
+from . import settings as msettings
+
+
+class MenusTraceMiddleware(MiddlewareMixin):
+    """
+    Collect menus processing trace of each request (see utils.trace) and
+    emit it as Server-Timing header, in debug mode trace is also saved as
+    json file into MENUS_TRACE_DUMP directory (if defined).
+    Without this middleware trace is not collected at all.
+    """
+
+    def process_request(self, request):
+        add_nodes_to_request(request)
+        request.nodes.trace = Trace()
+
+    def process_response(self, request, response):
+        trace = getattr(getattr(request, 'nodes', None), 'trace', None)
+        if trace and trace.menus:
+            timing = response.get('Server-Timing', None)
+            response['Server-Timing'] = ', '.join(
+                [i for i in (timing, trace.server_timing(),) if i])
+            if settings.DEBUG and msettings.TRACE_DUMP:
+                trace.dump(msettings.TRACE_DUMP, request.path)
+        return response
@@ -1,5 +1,7 @@
+import bisect
 from .base import Modifier, DEFAULT, ONCE, PER_REQUEST, POST_SELECT
-from .utils import tgenerator, tcutter, tfilter
+from .utils import tgenerator, tskipper, tfilter
+from .utils.arrays import get_tree_arrays
 
 
 __all__ = ('NavigationExtender', 'AuthVisibility', 'Jump',
@@ -24,12 +26,43 @@ class Namespace(Modifier):
     """
     modify_event = DEFAULT
 
+    def mutating(self, kwargs):
+        return bool(kwargs.get('namespace', None))
+
     def modify(self, request, data, meta, **kwargs):
         # main condition
         namespace = kwargs.get('namespace', None)
         if not namespace:
             return
 
+        # indexed entry points of pure namespace sub-forest (roots of
+        # current tree should be original ones, but some can be removed)
+        lookup = (data.get('namespaces', None) or {}).get(namespace, None)
+        if (data.get('namespaces', None) is not None and
+                not meta['modified_ancestors'] and
+                not meta['modified_descendants'] and
+                (not lookup or lookup['pure'])):
+            index, state = data['index'], data['state']
+            roots = set(i.index for i in data['nodes'])
+            entries = [index[i] for i in (lookup or {}).get('entries', [])]
+            entries = [i for i in entries
+                       if getattr(state.get_root(i), 'index', None) in roots]
+            for node in entries:
+                node.parent = None
+            data['nodes'] = entries
+            if not lookup or lookup['size'] != len(index):
+                meta.update(modified_ancestors=True, modified_descendants=True)
+            return
+
+        # vectorized filter (if available)
+        arrays = get_tree_arrays(data, meta)
+        if arrays:
+            data['nodes'], removed = arrays.filter_namespace(
+                data['index'], data['nodes'], namespace, data['state'].hidden)
+            removed and meta.update(modified_ancestors=True,
+                                    modified_descendants=True)
+            return
+
         temp = {'count': 0,}  # for closure
 
         def checker(node):
@@ -51,12 +84,30 @@ class Root(Modifier):
     """
     modify_event = DEFAULT
 
+    def mutating(self, kwargs):
+        return bool(kwargs.get('root_id', None))
+
     def modify(self, request, data, meta, **kwargs):
         # main condition
         root_id = kwargs.get('root_id', None)
         if not root_id:
             return
 
+        # indexed search in unmodified tree
+        if (data.get('reverse_ids', None) is not None and
+                not meta['modified_ancestors'] and
+                not meta['modified_descendants']):
+            index, state, nodes = data['index'], data['state'], []
+            for i in data['reverse_ids'].get(root_id, []):
+                if state.get_root(index[i]):
+                    nodes = [index[i]]
+                    break
+            meta['modified_ancestors'] = bool(nodes and nodes[0].parent)
+            if nodes:
+                nodes[0].parent = None
+            data['nodes'] = nodes
+            return
+
         nodes, modified_ancestors = [], False
         for node in tgenerator(data['nodes']):
             if node.data.get('reverse_id', None) == root_id:
@@ -82,6 +133,7 @@ class Level(Modifier):
     Note: Level adds "level" and "level_original" attributes to any node.
     """
     modify_event = ONCE | DEFAULT
+    mutates = False  # DEFAULT modify only follows other mutating modifiers
 
     def modify(self, request, data, meta, **kwargs):
         # a bit of optimizations
@@ -109,7 +161,12 @@ class Level(Modifier):
 
 
 class Jump(Modifier):
-    """Clone child url to parent if parent is marked as "jump", recursive."""
+    """
+    Clone child url to parent if parent is marked as "jump", recursive.
+    On ONCE jump targets are resolved bottom-up, on PER_REQUEST only chains
+    with hidden members are resolved again by "jumps" lookup (see
+    Processor.build_lookups), urls are saved into state overlay only.
+    """
     modify_event = ONCE | PER_REQUEST
 
     def modify(self, request, data, meta, **kwargs):
@@ -121,25 +178,78 @@ class Jump(Modifier):
                      if i.data.get('jump', False)]):
             return
 
+        if not meta['rebuild_mode']:
+            if ONCE == meta['modify_event']:
+                self.resolve(data)
+                return
+            if 'jumps' in data:
+                self.resolve_hidden(data, data['state'])
+                return
+
+        state = data['state'] if PER_REQUEST == meta['modify_event'] else None
+        nodes, roots = data['nodes'], meta['modified_descendants']
+        if state and isinstance(roots, set):
+            # only branches of roots with hidden nodes are resolved again
+            nodes = [i for i in nodes if i.index in roots]
+        nodes = tskipper(nodes, state.hidden) if state else tgenerator(nodes)
+
         chain = []
-        for node in tgenerator(data['nodes']):
-            if node.children and node.data.get('jump', False):
+        for node in nodes:
+            children = state.children(node) if state else node.children
+            if children and node.data.get('jump', False):
                 chain.append(node)
             elif chain:
                 chain.append(node)
-                self.clone_url(chain)
+                self.clone_url(chain, state)
                 chain = []
 
         if chain:
-            self.clone_url(chain)
+            self.clone_url(chain, state)
 
-    def clone_url(self, chain):
+    def resolve(self, data):
+        """Resolve jump targets bottom-up."""
+        nodes = list(tgenerator(data['nodes']))
+        targets = {}
+        for node in reversed(nodes):
+            if node.children and node.data.get('jump', False):
+                target = targets.get(node.children[0], node.children[0])
+                targets[node], node.url = target, target.url
+
+    def resolve_hidden(self, data, state):
+        """Resolve again chains, which have hidden members."""
+        index, jumps = data['index'], data['jumps']
+        tops = set(jumps[i] for i in state.hidden if i in jumps)
+        for top in [index[i] for i in sorted(tops)]:
+            if state.get_root(top) is None:
+                continue
+            chain, node = [], top
+            while True:
+                children = state.children(node)
+                if not (children and node.data.get('jump', False)):
+                    break
+                chain.append(node)
+                node = children[0]
+            if chain:
+                self.clone_url(chain + [node], state)
+
+    def clone_url(self, chain, state=None):
+        if not state:
+            for node in chain[:-1]:
+                node.url = chain[-1].url
+            return
+
+        url = state.get_url(chain[-1])
         for node in chain[:-1]:
-            node.url = chain[-1].url
+            state.urls[node.index] = url
 
 
 class AuthVisibility(Modifier):
-    """Remove nodes that are required an auth."""
+    """
+    Hide nodes that are required an auth (in state overlay).
+    Top auth required nodes are taken from "auth_required" lookup (see
+    Processor.build_lookups) if it is available, so only k nodes are hidden
+    without any tree traversal.
+    """
     modify_event = PER_REQUEST
 
     def modify(self, request, data, meta, **kwargs):
@@ -147,25 +257,48 @@ class AuthVisibility(Modifier):
         if request.user.is_authenticated():
             return
 
-        temp = {'count': 0,}  # in closure
-
-        def checker(node):
-            if node.data.get('auth_required', False):
-                temp['count'] += 1
-                return False
-            return True
+        state = data['state']
+        hidden, tops = state.hidden, data.get('auth_required', None)
+        if tops is not None and not meta['rebuild_mode']:
+            # already hidden subtrees (by previous modifiers) are skipped
+            index = data['index']
+            tops = ([i for i in tops if state.get_root(index[i])]
+                    if hidden else tops)
+            hidden.update(tops)
+            if tops:
+                # root of node is the last root before it in pre-order
+                starts = [i.index for i in data['nodes']]
+                self.modified_descendants(meta, set(
+                    starts[bisect.bisect_right(starts, i) - 1] for i in tops))
+            return
 
-        # cut auth_required nodes (all or only rebuilt)
-        nodes = ([i.children for i in data.get('rebuilt_nodes', [])]
-                 if meta['rebuild_mode'] else [data['nodes']])
-        for i in nodes:
-            tcutter(i, checker)
+        # hide auth_required nodes (all or only rebuilt)
+        if meta['rebuild_mode']:
+            nodes = [j for i in data.get('rebuilt_nodes', [])
+                     for j in i.children]
+            count = 0
+            for node in tskipper(nodes, hidden):
+                if node.data.get('auth_required', False):
+                    hidden.add(node.index)
+                    count += 1
+            count and self.modified_descendants(meta)
+            return
 
-        temp['count'] and meta.update(modified_descendants=True)
+        roots = set()
+        for root in data['nodes']:
+            for node in tskipper([root], hidden):
+                if node.data.get('auth_required', False):
+                    hidden.add(node.index)
+                    roots.add(root.index)
+        roots and self.modified_descendants(meta, roots)
 
 
 class NavigationExtender(Modifier):
-    """Extends menu item with another menu."""
+    """
+    Extends menu item with another menu.
+    Root nodes are indexed by namespace once, extender, which refers to
+    the branch of node itself (cycle), will not attach node's root node.
+    """
     modify_event = ONCE
 
     def modify(self, request, data, meta, **kwargs):
@@ -173,17 +306,26 @@ class NavigationExtender(Modifier):
         if meta['rebuild_mode']:
             return
 
-        nodes, processed = data['nodes'], []
+        nodes, processed, roots = data['nodes'], set(), {}
+        for node in nodes:
+            roots.setdefault(node.namespace, []).append(node)
+
         for node in tgenerator(nodes):
             extenders = node.data.get("navigation_extenders", None)
             if not extenders:
                 continue
             for extender in extenders:
-                if extender in processed:
+                if extender in processed or extender not in roots:
                     continue
-                processed.append(extender)
-                for n in nodes:  # process root nodes with extenders
-                    if n.namespace == extender:
+                processed.add(extender)
+
+                # search root of current node to avoid cycles
+                top = node
+                while top.parent:
+                    top = top.parent
+
+                for n in roots[extender]:  # process indexed root nodes
+                    if n is not top:
                         n.parent = node
                         node.children.append(n)
         # filter root nodes if any processed extenders
@@ -193,85 +335,94 @@ class NavigationExtender(Modifier):
 
 
 class MetaDataProcessor(Modifier):
+    """
+    Fill request metadata (chain, title, keywords and description) by
+    selected node. Metadata values, preloaded from selection index (see
+    Processor.load_selection), are not updated again.
+    """
     modify_event = POST_SELECT
 
     def modify(self, request, data, meta, **kwargs):
-        selected = data['selected']
-        chain = [i for i in (data['chain'] or [])
-                 if i.data.get('visible_in_chain', True)]
+        if getattr(request.nodes, 'preloaded', False):
+            return
+        self.update(request.nodes, self.values(data['selected'],
+                                               data['chain'], data['state']))
 
-        metadata = request.nodes
-        metadata.selected = selected
+    def values(self, selected, chain, state):
+        """Metadata values of selected node with its chain."""
+        chain = [i for i in (chain or [])
+                 if i.data.get('visible_in_chain', True)]
+        values = {'selected': selected, 'chain': [], 'title': [],
+                  'keywords': [], 'description': [], 'selected_title': None,}
         if chain:
+            values.update({
+                'chain': [{'name': n.title, 'link': state.get_url(n),
+                           'data': n.data,} for n in chain],
+                'title': [n.data.get('meta_title', u'') or n.title
+                          for n in chain],
+                'keywords': [chain[-1].data.get('meta_keywords', u'')],
+                'description': [chain[-1].data.get('meta_description', u'')],
+            })
+        if selected and not (chain and selected == chain[-1]):
+            # set selected meta_title to title tag anyway
+            values['selected_title'] = (selected.data.get('meta_title', u'')
+                                        or selected.title)
+        return values
+
+    def update(self, metadata, values):
+        """Save metadata values to request."""
+        metadata.selected = values['selected']
+        if values['chain']:
             metadata.keywords = getattr(metadata, 'keywords', [])
             metadata.description = getattr(metadata, 'description', [])
 
-            # save metadata to reauest
-            metadata.chain = [{'name': n.title, 'link': n.url, 'data': n.data,}
-                              for n in chain] + metadata.chain
-            metadata.title = [n.data.get('meta_title', u'') or n.title
-                              for n in chain] + metadata.title
-            metadata.keywords = [chain[-1].data.get('meta_keywords', u'')] + metadata.keywords
-            metadata.description = [chain[-1].data.get('meta_description', u'')] + metadata.description
-        if selected and not (chain and selected == chain[-1]):
-            # set selected meta_title to title tag anyway
-            metadata.title.append(selected.data.get('meta_title', u'') or selected.title)
+            metadata.chain = values['chain'] + metadata.chain
+            metadata.title = values['title'] + metadata.title
+            metadata.keywords = values['keywords'] + metadata.keywords
+            metadata.description = values['description'] + metadata.description
+        if values['selected_title'] is not None:
+            metadata.title.append(values['selected_title'])
 
 
 class PositionalMarker(Modifier):
     """
-    Marker adds "sibling", "ancestor", "descendant", "selected"
-    and "leaf" attributes to any node.
+    Marker enables "sibling", "ancestor", "descendant" and "leaf" marks
+    in state overlay (available in templates as node proxy attributes).
+    Only ancestors are marked here, other marks are computed on demand
+    by ONCE nodes index (see NodesState.is_leaf, ect).
     """
-    modify_event = ONCE | POST_SELECT
+    modify_event = POST_SELECT
 
     def modify(self, request, data, meta, **kwargs):
-        """
-        On ONCE just add required attributes.
-        On POST_SELECT mark leaf nodes and if selected exists,
-            mark siblings, ancestors and descendants.
-        """
-
-        nodes, selected = data['nodes'], data['selected']
-
-        if (ONCE == meta['modify_event']):
-            nodes = (data.get('rebuilt_nodes', [])
-                     if meta['rebuild_mode'] else nodes)
-            for node in tgenerator(nodes):
-                node.sibling = node.leaf = False
-                node.ancestor = node.descendant = False
-            return
+        """On POST_SELECT mark ancestors of selected node (if exists)."""
 
-        # mark leafs # does it really need?
-        for node in tgenerator(nodes):
-            node.leaf = not node.children
-
-        if not selected:
-            return
+        selected, state = data['selected'], data['state']
+        state.marked, state.index = True, data['index']
 
-        # mark siblings
-        siblings = selected.parent.children if selected.parent else nodes
-        for i in siblings:
-            i.sibling = not i.selected
-
-        # mark ancestors
         ancestor = selected
-        while ancestor.parent:
+        while ancestor and ancestor.parent:
             ancestor = ancestor.parent
-            ancestor.ancestor = True
-
-        # mark descendants
-        for i in tgenerator(selected.children):
-            i.descendant = True
+            state.ancestors.add(ancestor.index)
 
 
 class CutLevels(Modifier):
     """
     Filters nodes by its level and/or visible value.
-    Depends on PositionalMarker if root descendants expected.
+    Depends on PositionalMarker (state marks) if root descendants expected.
     """
     modify_event = DEFAULT
 
+    def mutating(self, kwargs):
+        return self.cut_levels(kwargs) is not None
+
+    def cut_levels(self, kwargs):
+        """Valid "cut_levels" kwargs value or None."""
+        cut_levels = kwargs.get('cut_levels', None)
+        if (not cut_levels or not isinstance(cut_levels, dict) or
+                not len(cut_levels) == 7):
+            return None
+        return cut_levels
+
     # !!! VISIBILITY
     def modify(self, request, data, meta, **kwargs):
         """
@@ -291,9 +442,8 @@ class CutLevels(Modifier):
         """
 
         # get argumets from cut_levels keyword argumet
-        cut_levels = kwargs.get('cut_levels', None)
-        if (not cut_levels or not isinstance(cut_levels, dict) or
-                not len(cut_levels) == 7 or not data['nodes']):
+        cut_levels = self.cut_levels(kwargs)
+        if cut_levels is None or not data['nodes']:
             return
 
         (from_level, to_level, extra_inactive, extra_active, extra_active_mode,
@@ -316,6 +466,10 @@ class CutLevels(Modifier):
         # from inactive branches (not sel-sib-desc or with ancestor parent)
         only_active_branch = (not show_inactive_branch and from_level > 0)
 
+        # vectorized cut of not trail roots (if available)
+        state, arrays = data['state'], get_tree_arrays(data, meta)
+        batch = []
+
         # process nodes with algorithm
         final = []
         for node in nodes:
@@ -324,17 +478,27 @@ class CutLevels(Modifier):
                 items = self.cut_before_and_after_active(
                     trail, from_level, to_level, extra_inactive, extra_active,
                     extra_active_mode, only_active_branch, show_invisible)
-            elif getattr(node, 'descendant', True):
+                final.append(items)
+                continue
+            elif not state.marked or state.is_descendant(node.index):
                 # (4) cut active root if it descendant
-                items = self.cut_before_and_after(
-                    node, from_level, to_level, extra_active,
-                    False, show_invisible)
+                extra_level, only_active = extra_active, False
             else:
                 # (2) cut inactive in from_level..to_level|extra_active
+                extra_level, only_active = extra_inactive, only_active_branch
+
+            if arrays and not (only_active or from_level > to_level):
+                items = []  # filled by arrays.cut_levels
+                batch.append((node, min(to_level, extra_level), items,))
+            else:
                 items = self.cut_before_and_after(
-                    node, from_level, to_level, extra_inactive,
-                    only_active_branch, show_invisible)
-            final.extend(items)
+                    node, from_level, to_level, extra_level,
+                    only_active, show_invisible)
+            final.append(items)
+
+        batch and arrays.cut_levels(data['index'], batch, from_level,
+                                    show_invisible, state.hidden)
+        final = [i for items in final for i in items]
 
         # update meta information and nodes data
         meta.update(
@@ -1,13 +1,35 @@
 import copy
+import hashlib
+import logging
+import os
 import re
+import threading
+import time
 import urlparse
+from collections import OrderedDict
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.contrib.sites.shortcuts import get_current_site
-from django.utils.translation import get_language
-from .base import Menu, DEFAULT, ONCE, PER_REQUEST, POST_SELECT
-from .utils import import_path, tgenerator
-from . import settings as msettings
+from django.http import HttpRequest
+from django.utils.translation import get_language, override
+from .base import (ClonedPaths, Menu, MenuConf, NavigationNode, NodeProxy,
+                   NodesState, DEFAULT, ONCE, PER_REQUEST, POST_SELECT)
+from .utils import import_path, tgenerator, tcutter, payload
+from .utils.arrays import TreeArrays, numpy
+from .utils.branches import IndexedPaths, load_nodes, split_nodes
+from .utils.lazydata import LazyData
+from .utils.rebuild import Rebuilder
+from .utils.shared import SharedTree, write_tree
+from . import settings as msettings, VERSION
+
+
+logger = logging.getLogger('nodes')
 
 
 class Processor(object):
@@ -20,23 +42,35 @@ class Processor(object):
 
     registry = None
 
+    # nodes data keys, which are not cloned for DEFAULT modifiers
+    shared_data = ('paths', 'arrays', 'reverse_ids', 'namespaces', 'jumps',
+                   'auth_required', 'ids',)
+    # node attributes, which are not hashed by fingerprint
+    unhashed = ('parent', 'children', 'fingerprint', 'index',)
+
     def __init__(self, registry):
         self.registry = registry
+        self._menuconfs = {}
         self._modifiers = {}
+        self._ROUTES = None
+        self._lock = threading.Lock()
+        self._shared = {}
+        self._built = OrderedDict()
+        self._built_lock = threading.Lock()
+        self._selections = OrderedDict()
+        self._selections_lock = threading.Lock()
+        self.rebuilder = None
+        self.cache = cache  # nodes cache, may be replaced (see utils.replay)
 
     def router(self, request):
         """
-        Simple router implementaion, based on url regexps.
-        If you need more complex validation, please update this method.
+        Simple router implementaion, based on url regexps (compiled by
+        compile_menus). If you need more complex validation, please update
+        this method.
         """
-        if not hasattr(self, '_ROUTES'):
-            self._ROUTES = [(name, conf['ROUTE'])
-                            for name, conf in msettings.MENUS.items()
-                            if conf.get('ROUTE', None)] or None
-
         if self._ROUTES:
             for name, route in self._ROUTES:
-                if re.match(route, request.path):
+                if route.match(request.path):
                     return name
 
         return 'default'
@@ -53,6 +87,44 @@ class Processor(object):
         return 'nodes_%s_%s_%s%s_cache' % (menuconf['NAME'],
                                            lang, site_id, extra)
 
+    def version_key(self, cache_key):
+        """Cache key of nodes version value (current version pointer)."""
+        return '%s_version' % cache_key
+
+    def nodes_key(self, cache_key, version):
+        """Cache key of nodes data with version."""
+        return '%s_%s' % (cache_key, version)
+
+    def new_version(self, nodes):
+        """
+        Generate version value of new cached nodes data: nodes content
+        fingerprint (see fingerprint) or timestamp if it is not defined.
+        """
+        return (nodes.get('fingerprint', None) or
+                '%x' % int(time.time() * 1000000))
+
+    def visibility_class(self, request):
+        """
+        Get visibility class of request - any requests with same class
+        should get same PER_REQUEST nodes tree (see AuthVisibility).
+        """
+        return 'auth' if request.user.is_authenticated() else 'anon'
+
+    def get_etag(self, request, menuconf, modifiers=None):
+        """
+        Get etag of menuconf nodes by cached version and visibility class
+        without nodes loading, None if version is not cached yet.
+        """
+        menuconf = self.menuconf(request, name=menuconf)
+        cache_key = self.cache_key(request=request, menuconf=menuconf)
+        version = self.cache.get(self.version_key(cache_key), None)
+        if version is None:
+            return None
+        value = ':'.join(map(str, [cache_key, version,
+                                   self.visibility_class(request),
+                                   modifiers or '',]))
+        return '"%s"' % hashlib.md5(value).hexdigest()
+
     def menuconf(self, request, name=None):
         """Get menuconf value, call router if required (once)"""
 
@@ -69,26 +141,42 @@ class Processor(object):
             request.nodes._menuconf_selected = self.router(request)
             request.nodes._menuconf = {}
 
-        # get menuconf and cache it
+        # get compiled menuconf (selected or not) and cache it in request,
+        # selection state is never saved into shared values
         name = name or request.nodes._menuconf_selected
         conf = request.nodes._menuconf.get(name, None)
         if not conf:
-            conf = msettings.MENUS.get(name, None)
-            if conf is None:
-                raise ValueError('Menus menuconf invalid name (%s).' % name)
-
-            conf['SELECTED'] = name == request.nodes._menuconf_selected
+            conf = self.get_menuconf(
+                name, name == request.nodes._menuconf_selected)
             request.nodes._menuconf[name] = conf
 
         return conf
 
+    def get_menuconf(self, name, selected=False):
+        """Get compiled menuconf value by name (see compile_menus)."""
+        conf = self._menuconfs.get((name, bool(selected),), None)
+        if conf is None:
+            raise ValueError('Menus menuconf invalid name (%s).' % name)
+        return conf
+
     # Nodes processing methods
     # ------------------------
-    def get_nodes(self, menuconf, request,
-                  modifiers=None, init_only=False, **kwargs):
-        """Generate nodes by menu confname."""
+    def get_nodes(self, menuconf, request, modifiers=None, init_only=False,
+                  readonly=False, **kwargs):
+        """
+        Generate nodes by menu confname. Result is private nodes copy with
+        per-request state values (see apply_state). If result is only read
+        (readonly), nodes are not cloned for modifiers group without mutating
+        DEFAULT modifiers (see mutating): request-level nodes tree is
+        returned, so hidden nodes are not removed and state values are not
+        applied (state should be used, as renderers do).
+        """
 
         menuconf = self.menuconf(request, name=menuconf)
+        trace = getattr(request.nodes, 'trace', None)
+        if trace is not None:
+            trace = trace.menu(menuconf['NAME'])
+            trace['calls'], start = trace['calls'] + 1, time.time()
 
         # cache requested menuconf nodes in request object
         nodes = getattr(request.nodes, 'menus', {}).get(menuconf['NAME'], None)
@@ -96,27 +184,35 @@ class Processor(object):
             request.nodes.menus = getattr(request.nodes, 'menus', {})
 
             cache_key = self.cache_key(request=request, menuconf=menuconf)
-            cache_required = False
+            shared = bool(msettings.SHARED_TREES_DIR)
             rebuild_mode = False
             rebuild_countdown = 10
 
             while rebuild_countdown:
                 rebuild_countdown -= 1
                 meta = {'rebuild_mode': rebuild_mode,}
-                nodes = cache.get(cache_key, None) if nodes is None else nodes
-
                 if nodes is None:
-                    nodes = self.build_nodes(request, menuconf['MENUS'])
-                    nodes = {'nodes': nodes, 'selected': None, 'chain': None,}
-                    cache_required = True
+                    nodes = self.get_cached_nodes(menuconf, cache_key, request)
+                    if trace:
+                        trace['cache'] = 'miss' if nodes is None else 'hit'
 
-                # running once cached code (ONCE)
-                self.apply_modifiers(menuconf, nodes, request,
-                                     modify_event=ONCE, meta=meta)
-                self.post_build_data_handler(menuconf, nodes, request, meta)
-
-                if cache_required and not rebuild_mode:
-                    cache.set(cache_key, nodes, menuconf['CACHE_TIMEOUT'])
+                if nodes is None:
+                    # created nodes can be reused by next builds (see
+                    # create_nodes), so protect them as process-shared
+                    built = time.time()
+                    nodes = self.create_nodes(menuconf, request, cache_key)
+                    shared = True
+                    if trace:
+                        trace['build'] += time.time() - built
+                elif rebuild_mode:
+                    self.prepare_nodes(menuconf, nodes, request, meta)
+
+                # per-request values are stored in state overlay only,
+                # so ONCE nodes tree is not modified anymore
+                # (menuconf name keys process-cached selection results)
+                if 'state' not in nodes:
+                    nodes = dict(nodes, state=NodesState(),
+                                 menuconf=menuconf['NAME'])
 
                 # per-request cached code (PER_REQUEST)
                 self.apply_modifiers(menuconf, nodes, request,
@@ -128,14 +224,30 @@ class Processor(object):
                 # todo: may be add CHECK_SELECTION param to conf?
                 if menuconf['SELECTED']:
                     selected, chain = self.search_selected(request, nodes)
+
+                    # process-shared nodes should not be modified by
+                    # on_selected, so it gets private copy of nodes with
+                    # paths and lookups (not clone_nodes, which shares them)
+                    if (selected and shared and type(selected).on_selected !=
+                            NavigationNode.on_selected):
+                        memo, shared = {}, False
+                        nodes = copy.deepcopy(nodes, memo)
+                        selected, chain = (memo[id(selected)],
+                                           [memo[id(i)] for i in chain],)
+
                     rebuild_mode = (
                         selected and not getattr(selected, 'rebuilt', None) and
                         selected.on_selected(menuconf, nodes, request))
                     if rebuild_mode:
-                        selected.selected, selected.rebuilt = False, True
+                        nodes['state'].selected, selected.rebuilt = None, True
+                        nodes['rebuilt'] = True
+                        if trace:
+                            trace['rebuilds'] += 1
                         continue
 
                     nodes.update(selected=selected, chain=chain)
+                    # chain data is read by POST_SELECT (metadata)
+                    self.load_data([i.data for i in chain or ()])
                 break
 
             if not rebuild_countdown:
@@ -148,15 +260,867 @@ class Processor(object):
             request.nodes.menus[menuconf['NAME']] = nodes
 
         if init_only:
+            if trace:
+                trace['time'] += time.time() - start
             return
 
-        # clone nodes and run apply_modifiers with DEFAULT modify_event
-        nodes = copy.deepcopy(nodes)
+        if readonly and not self.mutating(menuconf, modifiers, kwargs):
+            nodes = dict(nodes)
+            self.apply_modifiers(menuconf, nodes, request,
+                                 modify_event=DEFAULT, modifiers=modifiers,
+                                 kwargs=kwargs)
+            if trace:
+                trace['time'] += time.time() - start
+            return nodes
+
+        # clone nodes (lookup indexes are shared), remove hidden by state
+        # and run apply_modifiers with DEFAULT modify_event
+        nodes = self.clone_nodes(nodes)
+        if trace:
+            trace['copies'] += 1
+        hidden = nodes['state'].hidden
+        if hidden:
+            # not loaded branches of lazy nodes are cut on loading
+            loader = getattr(nodes['index'], 'loader', None)
+            if loader:
+                loader.exclude(nodes['nodes'], hidden)
+            else:
+                tcutter(nodes['nodes'], lambda i: i.index not in hidden)
         self.apply_modifiers(menuconf, nodes, request, modify_event=DEFAULT,
                              modifiers=modifiers, kwargs=kwargs)
+        self.apply_state(nodes)
+
+        if trace:
+            trace['time'] += time.time() - start
+        return nodes
+
+    def create_nodes(self, menuconf, request, cache_key):
+        """
+        Build nodes data, prepare it and save to cache with new version.
+        If built nodes fingerprint is equal to previous one, previous data
+        (prepared by ONCE, with paths and lookups) is reused with its version,
+        so any values cached by version are still valid. Previous data is
+        not reused from cache in lazy data mode (see split_data): it has
+        no node data values, which are not stored in tree.
+        """
+        if self.labelled(menuconf):
+            return self.create_labelled_nodes(menuconf, request, cache_key)
+
+        built = self.build_nodes(request, menuconf['MENUS'])
+        fingerprint = self.fingerprint(menuconf, built)
+
+        nodes = self.built_cache_get(cache_key)
+        if ((nodes is None or nodes.get('fingerprint', None) != fingerprint)
+                and not self.lazy_data()):
+            nodes = self.cache_get(self.nodes_key(cache_key, fingerprint))
+        if nodes is None or nodes.get('fingerprint', None) != fingerprint:
+            nodes = {'nodes': built, 'selected': None, 'chain': None,
+                     'fingerprint': fingerprint,}
+            self.prepare_nodes(menuconf, nodes, request,
+                               {'rebuild_mode': False,})
+            nodes['version'] = self.new_version(nodes)
+        self.set_cached_nodes(menuconf, cache_key, nodes)
+        self.built_cache_set(cache_key, nodes)
+        self.remember_language(menuconf)
+        return nodes
 
+    def built_cache_get(self, cache_key):
+        """Get last built nodes data of process by cache key or None."""
+        with self._built_lock:
+            nodes = self._built.pop(cache_key, None)
+            if nodes is not None:
+                self._built[cache_key] = nodes
         return nodes
 
+    def built_cache_set(self, cache_key, nodes):
+        if msettings.BUILT_CACHE_SIZE <= 0:
+            return
+        with self._built_lock:
+            self._built.pop(cache_key, None)
+            while len(self._built) >= msettings.BUILT_CACHE_SIZE:
+                self._built.popitem(last=False)
+            self._built[cache_key] = nodes
+
+    def remember_language(self, menuconf):
+        """
+        Remember built language for background rebuild. Languages set is
+        updated under cache lock key (cache.add is atomic), so concurrent
+        builds in other processes do not overwrite each other languages.
+        """
+        key, lang = self.languages_key(menuconf), get_language()
+        if lang in (self.cache.get(key, None) or ()):
+            return
+        lock = '%s_lock' % key
+        for i in range(10):
+            if self.cache.add(lock, True, 5):
+                try:
+                    languages = self.cache.get(key, None) or set()
+                    self.cache.set(key, languages | set([lang]), None)
+                finally:
+                    self.cache.delete(lock)
+                return
+            time.sleep(0.01)
+        logger.warning('Menus language %s is not remembered for %s (cache'
+                       ' lock is busy).', lang, menuconf['NAME'])
+
+    def fingerprint(self, menuconf, nodes):
+        """
+        Set Merkle-style hash of each built node subtree (class, attributes
+        values except unhashed and children hashes) to node.fingerprint and
+        return fingerprint of nodes list with menuconf ONCE processing
+        settings.
+        """
+        unhashed = self.unhashed
+        for node in reversed(list(tgenerator(nodes))):
+            value = hashlib.md5(pickle.dumps((
+                node.__class__, sorted(i for i in node.__dict__.items()
+                                       if i[0] not in unhashed),), 2))
+            for child in node.children:
+                value.update(child.fingerprint)
+            node.fingerprint = value.hexdigest()
+
+        value = hashlib.md5(repr((VERSION, menuconf['MENUS'],
+                                  menuconf['MODIFIERS']['default'],) +
+                                 ((msettings.TREE_DATA_KEYS,)
+                                  if self.lazy_data() else ())))
+        for node in nodes:
+            value.update(node.fingerprint)
+        return value.hexdigest()
+
+    def prepare_nodes(self, menuconf, nodes, request, meta):
+        """Run once cached code (ONCE), after it cached nodes are ready."""
+        self.apply_modifiers(menuconf, nodes, request,
+                             modify_event=ONCE, meta=meta)
+        self.index_nodes(nodes, meta)
+        self.post_build_data_handler(menuconf, nodes, request, meta)
+
+    def apply_state(self, nodes):
+        """
+        Set per-request state values (url, selected and positional marks)
+        to nodes of private copy, so result can be used without state.
+        Not loaded branches of lazy nodes get values on loading, leaf mark
+        of their roots is set by children indexes (see NodesState).
+        Lazy node data of copy is grouped (loaded by single get_many).
+        """
+        state, items, pending = nodes['state'], [], False
+        group = [] if self.lazy_data() else None
+        for node in nodes['nodes']:
+            if getattr(node.children, 'loaded', True):
+                items.append(node)
+            else:
+                pending = True
+                self.set_state_values(state, [node], group)
+        self.set_state_values(state, tgenerator(items), group)
+
+        loader = getattr(nodes['index'], 'loader', None)
+        if loader and pending:
+            def filled(position, children):
+                self.set_state_values(state, tgenerator(children),
+                                      None if group is None else [])
+            loader.filled = filled
+
+    def set_state_values(self, state, nodes, group=None):
+        for node in nodes:
+            index = node.index
+            if index is None:
+                continue
+            node.url = state.get_url(node)
+            node.selected = index == state.selected
+            if state.marked:
+                node.leaf = state.is_leaf(index)
+                node.sibling = state.is_sibling(index)
+                node.ancestor = state.is_ancestor(index)
+                node.descendant = state.is_descendant(index)
+            if group is not None and getattr(node.data, 'lazy', False):
+                node.data.group = group
+                group.append(node.data)
+
+    def clone_nodes(self, nodes, memo=None):
+        """
+        Deep copy of nodes data, keys from shared_data are not copied,
+        shared paths resolve nodes of copy (see ClonedPaths).
+        """
+        memo = {} if memo is None else memo
+        memo.update((id(nodes[key]), nodes[key])
+                    for key in self.shared_data if key in nodes)
+        clone = copy.deepcopy(nodes, memo)
+        if clone.get('paths', None) is not None and 'index' in clone:
+            clone['paths'] = ClonedPaths(clone['paths'], clone['index'])
+        return clone
+
+    def get_cached_nodes(self, menuconf, cache_key, request=None):
+        """
+        Get cached nodes data. If shared trees are enabled (SHARED_TREES_DIR),
+        lazy nodes data is loaded once per version in process from shared
+        tree file (written by any process, from cache if file is outdated),
+        its branches are unpickled in process on access (see utils.shared).
+        In branch storage mode (BRANCH_STORAGE) lazy nodes data is loaded
+        (see load_branches). In lazy data mode node data values, which are
+        not stored in tree, are loaded on access (see split_data).
+        """
+        version = self.cache.get(self.version_key(cache_key), None)
+        if version is None:
+            return None
+        if self.labelled(menuconf):
+            return self.get_labelled_nodes(menuconf, cache_key, version)
+        if not msettings.SHARED_TREES_DIR:
+            if msettings.BRANCH_STORAGE:
+                return self.load_branches(menuconf, cache_key, version,
+                                          request)
+            return self.cache_get(self.nodes_key(cache_key, version))
+
+        nodes = self._shared.get(cache_key, None)
+        if nodes is None or nodes['version'] != version:
+            path = self.shared_tree_path(cache_key)
+            tree = SharedTree.open(path, version)
+            if not tree:
+                nodes = self.cache_get(self.nodes_key(cache_key, version))
+                if nodes is None:
+                    return None
+                write_tree(path, version, nodes)
+                tree = SharedTree.open(path, version)
+            nodes = tree.load() if tree else nodes
+            self._shared[cache_key] = nodes
+        return nodes
+
+    def set_cached_nodes(self, menuconf, cache_key, nodes):
+        """
+        Save nodes data (and shared file) under its version and then replace
+        version pointer, so readers get either previous or new nodes data.
+        If nodes data is not saved, version pointer is not replaced.
+        """
+        version, timeout = nodes['version'], menuconf['CACHE_TIMEOUT']
+        key = self.nodes_key(cache_key, version)
+        if msettings.SHARED_TREES_DIR:
+            write_tree(self.shared_tree_path(cache_key), version, nodes)
+            self._shared[cache_key] = nodes
+            values = {key: nodes,}
+        else:
+            values = {}
+            if self.lazy_data():
+                nodes, values = self.split_data(menuconf, cache_key, nodes)
+            if msettings.BRANCH_STORAGE:
+                head, branches = split_nodes(nodes)
+                values.update(self.branches_values(cache_key, version,
+                                                   branches))
+                values[key] = head
+            else:
+                values[key] = nodes
+
+        if not self.cache_set_many(menuconf, values, timeout):
+            self.cache.set(self.version_key(cache_key), version, timeout)
+
+    def shared_tree_path(self, cache_key):
+        return os.path.join(msettings.SHARED_TREES_DIR, '%s.nodes' % cache_key)
+
+    # Cache payloads (see utils.payload)
+    # ----------------------------------
+    def cache_get(self, key):
+        cache = self.cache
+        return payload.decode(key, cache.get(key, None), cache.get_many)
+
+    def cache_get_many(self, keys):
+        values = ((k, payload.decode(k, v, self.cache.get_many),)
+                  for k, v in self.cache.get_many(keys).items())
+        return dict((k, v) for k, v in values if v is not None)
+
+    def cache_set_many(self, menuconf, values, timeout):
+        """
+        Save values encoded by COMPRESS_THRESHOLD and CHUNK_SIZE settings,
+        log encoded size and check that entries are saved: any backend can
+        silently ignore too large values (and set_many reports not saved
+        keys only since Django 2.0), so all entries (main and chunks) are
+        read back by single get_many, with CHECK_PAYLOAD read values are
+        also compared with saved ones. Returns not saved keys list.
+        """
+        entries, raw, encoded, chunks = {}, 0, 0, 0
+        for key, value in values.items():
+            items, sizes = payload.encode(key, value,
+                                          msettings.COMPRESS_THRESHOLD,
+                                          msettings.CHUNK_SIZE)
+            entries.update(items)
+            raw, encoded, chunks = (raw + sizes[0], encoded + sizes[1],
+                                    chunks + sizes[2],)
+
+        failed = set(self.cache.set_many(entries, timeout) or ())
+        logger.info('Menus "%s" payload: %d bytes encoded (%d raw, %d entries,'
+                    ' %d chunks).', menuconf['NAME'], encoded, raw,
+                    len(values), chunks)
+
+        saved = self.cache.get_many(list(entries))
+        failed.update(key for key in entries if key not in saved)
+        if msettings.CHECK_PAYLOAD:
+            failed.update(key for key, value in saved.items()
+                          if value != entries[key])
+        failed = sorted(failed)
+        if failed:
+            logger.error('Menus "%s" payload is not saved to cache (%d bytes'
+                         ' encoded), missing entries: %s.', menuconf['NAME'],
+                         encoded, ', '.join(failed))
+        return failed
+
+    # Branch storage (partial nodes loading)
+    # --------------------------------------
+    def branch_key(self, cache_key, version, position):
+        """Cache key of top-level branch (root children) of nodes version."""
+        return '%s_%s_branch%d' % (cache_key, version, position)
+
+    def branches_values(self, cache_key, version, branches):
+        return [(self.branch_key(cache_key, version, position), value)
+                for position, value in enumerate(branches)]
+
+    def load_branches(self, menuconf, cache_key, version, request=None):
+        """
+        Load lazy nodes data by head cache entry (roots and lookups), branches
+        are fetched from cache on first access (see utils.branches). Branches
+        of request path candidates (see search_selected) are fetched at once.
+        """
+        head = self.cache_get(self.nodes_key(cache_key, version))
+        if head is None or 'starts' not in head:
+            return None
+
+        def fetch(positions):
+            keys = [self.branch_key(cache_key, version, i) for i in positions]
+            values = self.cache_get_many(keys)
+            if len(values) != len(keys):
+                values = self.restore_branches(menuconf, cache_key, version)
+            return [values[key] for key in keys]
+
+        nodes = load_nodes(head, fetch)
+        if request is not None and 'paths' in nodes:
+            path = request.path.strip('/').split('/')
+            positions = [nodes['paths'].position('/'.join(path[:-i or None]))
+                         for i in range(0, len(path))]
+            nodes['index'].loader.load([i for i in positions
+                                        if i is not None])
+        return nodes
+
+    def restore_branches(self, menuconf, cache_key, version):
+        """
+        Build nodes again if any branch of version is evicted from cache,
+        branches can be restored only if built nodes have same version.
+        """
+        nodes = self.create_nodes(menuconf, self.rebuild_request(), cache_key)
+        if nodes['version'] != version:
+            raise ValueError('Menus nodes branches of version %s are not'
+                             ' available.' % version)
+        return dict(self.branches_values(cache_key, version,
+                                         split_nodes(nodes)[1]))
+
+    # Lazy node data (see utils.lazydata)
+    # -----------------------------------
+    def lazy_data(self):
+        """
+        Check lazy data mode: node data values of keys, which are not in
+        TREE_DATA_KEYS, are stored separately (not in shared trees mode).
+        """
+        return bool(msettings.TREE_DATA_KEYS and
+                    not msettings.SHARED_TREES_DIR)
+
+    def data_key(self, cache_key, version, index):
+        """Cache key of node data values, which are not stored in tree."""
+        return '%s_%s_data%d' % (cache_key, version, index)
+
+    def data_values(self, nodes, cache_key):
+        """Node data values, which are not stored in tree, by data keys."""
+        keys, version, values = (msettings.TREE_DATA_KEYS, nodes['version'],
+                                 {},)
+        for node in nodes['index']:
+            data = dict((k, v) for k, v in node.data.items() if k not in keys)
+            if data:
+                values[self.data_key(cache_key, version, node.index)] = data
+        return values
+
+    def split_data(self, menuconf, cache_key, nodes):
+        """
+        Split node data by TREE_DATA_KEYS, returns nodes data copy with
+        lazy node data (values of tree keys) and cache values of other node
+        data values (separate entry of each node).
+        """
+        keys = tuple(msettings.TREE_DATA_KEYS)
+        source = (menuconf['NAME'], cache_key, nodes['version'],)
+        self.load_data([i.data for i in nodes['index']])
+
+        memo = {}
+        for node in nodes['index']:
+            data = node.data
+            if id(data) not in memo:
+                memo[id(data)] = LazyData(
+                    [(k, v) for k, v in data.items() if k in keys],
+                    source, node.index, keys,
+                    bool([k for k in data.keys() if k not in keys]))
+        # shared data is also copied: paths reference nodes
+        return (copy.deepcopy(nodes, memo),
+                self.data_values(nodes, cache_key),)
+
+    def load_data(self, items):
+        """
+        Load not loaded lazy node data items by single get_many. Node data
+        of version evicted from cache is restored by nodes building.
+        """
+        items = [i for i in items if isinstance(i, LazyData) and i.lazy]
+        if not items:
+            return
+        keys = [self.data_key(i.source[1], i.source[2], i.index)
+                for i in items]
+        values = self.cache_get_many(keys)
+        if len(values) != len(set(keys)):
+            values = {}
+            for source in set(i.source for i in items):
+                values.update(self.restore_data(*source))
+        for item, key in zip(items, keys):
+            item.fill(values.get(key, {}))
+
+    def restore_data(self, name, cache_key, version):
+        """
+        Build nodes again if node data of version is evicted from cache,
+        it can be restored only if built nodes have same version.
+        """
+        menuconf = self.get_menuconf(name)
+        # labelled nodes structure is built in default language
+        with override(settings.LANGUAGE_CODE if menuconf.get('LABELS', False)
+                      else get_language()):
+            nodes = self.create_nodes(menuconf, self.rebuild_request(),
+                                      cache_key)
+        if nodes['version'] != version:
+            raise ValueError('Menus node data of version %s is not'
+                             ' available.' % version)
+        return self.data_values(nodes, cache_key)
+
+    # Label tables (language independent nodes structure)
+    # ----------------------------------------------------
+    def labelled(self, menuconf):
+        """
+        Check that nodes of current language are labelled structure: if
+        menuconf LABELS option is enabled, nodes structure is built and
+        cached once in default language (LANGUAGE_CODE), other languages
+        get it with translated fields from cached label table.
+        """
+        return (menuconf.get('LABELS', False) and
+                get_language() != settings.LANGUAGE_CODE)
+
+    def structure_key(self, menuconf):
+        """Cache key of labelled nodes structure (default language)."""
+        return self.cache_key(menuconf=menuconf, lang=settings.LANGUAGE_CODE)
+
+    def labels_key(self, cache_key, version):
+        """Cache key of label table with labelled nodes version."""
+        return '%s_%s_labels' % (cache_key, version)
+
+    def create_labelled_nodes(self, menuconf, request, cache_key):
+        """
+        Build label table of current language for cached (or created)
+        nodes structure and save it. Labelled nodes version is structure
+        version with label table hash.
+        """
+        with override(settings.LANGUAGE_CODE):
+            structure_key = self.structure_key(menuconf)
+            nodes = (self.get_cached_nodes(menuconf, structure_key) or
+                     self.create_nodes(menuconf, request, structure_key))
+
+        labels = self.build_labels(menuconf, request, nodes)
+        version = '%s.%s' % (nodes['version'], hashlib.md5(
+            pickle.dumps(labels, 2)).hexdigest())
+        timeout = menuconf['CACHE_TIMEOUT']
+        if not self.cache_set_many(
+                menuconf, {self.labels_key(cache_key, version): labels,},
+                timeout):
+            self.cache.set(self.version_key(cache_key), version, timeout)
+        self.remember_language(menuconf)
+
+        # structure can be used by other requests, so label copy
+        return self.apply_labels(menuconf, copy.deepcopy(nodes), labels,
+                                 version)
+
+    def get_labelled_nodes(self, menuconf, cache_key, version):
+        """Get cached nodes structure with label table by labelled version."""
+        labels = self.cache_get(self.labels_key(cache_key, version))
+        if labels is None:
+            return None
+        with override(settings.LANGUAGE_CODE):
+            nodes = self.get_cached_nodes(menuconf,
+                                          self.structure_key(menuconf))
+        if nodes is None or nodes['version'] != version.split('.', 1)[0]:
+            return None
+        if msettings.SHARED_TREES_DIR:
+            nodes = copy.deepcopy(nodes)
+        return self.apply_labels(menuconf, nodes, labels, version)
+
+    def build_labels(self, menuconf, request, nodes):
+        """
+        Build label table by menus get_labels: values lists (title, url and
+        data updates) by node.index (None if not translated) and paths
+        ({path: node.index}) if any url is translated.
+        """
+        values = {}
+        for name in menuconf['MENUS']:
+            menu = self.registry.menus[name]
+            for key, value in menu.get_labels(request).items():
+                key = key if isinstance(key, tuple) else (menu.namespace, key)
+                values[key] = value
+
+        index, empty = nodes['index'], {}
+        labels = dict((k, [values.get((i.namespace, i.id,), empty).get(k, None)
+                           for i in index],)
+                      for k in ('title', 'url', 'data',))
+        labels['paths'] = None
+        if [i for i in labels['url'] if i is not None]:
+            labelled = self.apply_labels(menuconf, copy.deepcopy(nodes),
+                                         dict(labels, paths={}), None)
+            labels['paths'] = dict(
+                (k, v.index) for k, v in
+                self.build_paths(labelled['nodes']).items())
+        return labels
+
+    def apply_labels(self, menuconf, nodes, labels, version):
+        """
+        Update nodes structure (not shared copy) by label table. Nodes of
+        not loaded branches (see utils.branches) are updated on loading.
+        """
+        index = nodes['index']
+        loader = getattr(index, 'loader', None)
+        if loader is None or 'jumps' not in nodes:
+            for node in index:
+                self.label_node(node, labels)
+            if labels['paths'] is not None:
+                nodes['paths'] = dict((k, index[v])
+                                      for k, v in labels['paths'].items())
+                # jump urls by translated targets
+                if 'Jump' in menuconf['MODIFIERS']['default']:
+                    self.registry.modifiers['Jump'].resolve(nodes)
+        else:
+            # jump chain members get url of chain end (last member)
+            targets, chains = {}, {}
+            if (labels['paths'] is not None and
+                    'Jump' in menuconf['MODIFIERS']['default']):
+                for member, top in nodes['jumps'].items():
+                    targets[top] = max(targets.get(top, member), member)
+                for member, top in nodes['jumps'].items():
+                    if member != targets[top]:
+                        chains[member] = targets[top]
+                chains.update(targets)
+
+            def prepare(position, children):
+                for node in tgenerator(children):
+                    self.label_node(node, labels, chains)
+
+            for node in nodes['nodes']:
+                self.label_node(node, labels, chains)
+                if getattr(node.children, 'loaded', True):
+                    prepare(None, node.children)
+            loader.prepare = prepare
+            if labels['paths'] is not None:
+                nodes['paths'] = IndexedPaths(loader, dict(labels['paths']))
+
+        nodes.pop('fingerprint', None)
+        nodes['version'] = version
+        return nodes
+
+    def label_node(self, node, labels, chains=None):
+        """
+        Update node by label table, jump chain members (chains is {index:
+        chain end index}) get url of translated chain end.
+        """
+        i = node.index
+        if labels['title'][i] is not None:
+            node.title = labels['title'][i]
+        if labels['data'][i]:
+            node.data = node.data.copy()
+            node.data.update(labels['data'][i])
+        if labels['paths'] is not None:
+            url = node.url  # resolved (ONCE) url of chain end for members
+            if labels['url'][i] is not None:
+                node.url = node.url_original = labels['url'][i]
+            if chains and i in chains:
+                node.url = labels['url'][chains[i]] or url
+
+    # Background rebuild (see Registry.register_signals)
+    # --------------------------------------------------
+    def schedule_rebuild(self, namespace):
+        """Schedule background rebuild of menuconfs, which contain menu."""
+        names = [name for (name, selected), conf in self._menuconfs.items()
+                 if not selected and namespace in conf['MENUS']]
+        if names:
+            with self._lock:
+                if self.rebuilder is None:
+                    self.rebuilder = Rebuilder(self, msettings.REBUILD_DELAY)
+            self.rebuilder.schedule(names)
+
+    def rebuild_request(self):
+        """Request for nodes building outside of request cycle."""
+        request = HttpRequest()
+        request.path = request.path_info = '/'
+        request.user = AnonymousUser()
+        self.add_nodes_to_request(request)
+        return request
+
+    def languages_key(self, menuconf):
+        """Cache key of languages set, menuconf nodes were built for."""
+        return 'nodes_%s_languages' % menuconf['NAME']
+
+    def rebuild(self, name):
+        """
+        Rebuild menuconf nodes for each built language of current site
+        and replace cached ones (requests are not blocked).
+        """
+        menuconf = self.get_menuconf(name)
+        languages = (self.cache.get(self.languages_key(menuconf), None) or
+                     set())
+        # default language goes first (labelled nodes structure)
+        code = settings.LANGUAGE_CODE
+        for lang in sorted(languages | set([code]),
+                           key=lambda i: (i != code, i)):
+            with override(lang):
+                request = self.rebuild_request()
+                cache_key = self.cache_key(request=request, menuconf=menuconf)
+                self.create_nodes(menuconf, request, cache_key)
+
+    # Selection index (meta-only pages)
+    # ---------------------------------
+    def selection_key(self, cache_key, version, vclass, path):
+        """Cache key of selection index entry by request path (hashed)."""
+        return '%s_%s_selection_%s_%s' % (
+            cache_key, version, vclass,
+            hashlib.md5(path.encode('utf8')).hexdigest())
+
+    def load_selection(self, request, menuconf=None):
+        """
+        Fill request metadata (see MetaDataProcessor) by selection index of
+        routed menuconf without nodes loading. If index entry of request
+        path is not cached for current nodes version and visibility class,
+        nodes are loaded as usual (get_nodes with init_only) and entry is
+        saved (see save_selection).
+        """
+        menuconf = self.menuconf(request, name=menuconf)
+        metadata = request.nodes
+        if (not menuconf['SELECTED'] or metadata.preloaded or
+                menuconf['NAME'] in getattr(metadata, 'menus', {})):
+            return
+
+        cache_key = self.cache_key(request=request, menuconf=menuconf)
+        version = self.cache.get(self.version_key(cache_key), None)
+        vclass = self.visibility_class(request)
+        if version is not None:
+            key = self.selection_key(cache_key, version, vclass,
+                                     request.path.strip('/'))
+            values = self.cache.get(key, False)
+            # entry is not saved yet or selected node requires full nodes
+            if values is not False:
+                modifier = self.registry.modifiers['MetaDataProcessor']
+                modifier.update(metadata, values)
+                metadata.preloaded = True
+                return
+
+        self.get_nodes(menuconf, request, init_only=True)
+        nodes = metadata.menus[menuconf['NAME']]
+        if nodes.get('version', None):
+            self.save_selection(menuconf, request, nodes, cache_key, vclass)
+
+    def save_selection(self, menuconf, request, nodes, cache_key, vclass):
+        """
+        Save selection index entry of request path: metadata values of
+        selection or False if selected node requires full nodes.
+        """
+        if 'MetaDataProcessor' not in menuconf['MODIFIERS']['default']:
+            return
+
+        selected, chain = nodes.get('selected', None), nodes.get('chain', None)
+        if nodes.get('rebuilt', False) or (
+                selected and type(selected).on_selected !=
+                NavigationNode.on_selected):
+            values = False
+        else:
+            modifier = self.registry.modifiers['MetaDataProcessor']
+            values = modifier.values(selected, chain, nodes['state'])
+            if selected:
+                # selected node is saved without links (not whole tree)
+                values['selected'] = copy.copy(selected)
+                values['selected'].parent = None
+                values['selected'].children = []
+
+        self.cache.set(self.selection_key(cache_key, nodes['version'], vclass,
+                                          request.path.strip('/')),
+                       values, menuconf['CACHE_TIMEOUT'])
+
+    # Nodes patching
+    # --------------
+    def patch(self, menuconf, ops):
+        """
+        Patch cached (ONCE) menuconf nodes of current language without full
+        rebuild and save it with new version. Returns patched nodes data or
+        None if nodes are not cached yet (nothing to patch).
+        Operations list items (key is (namespace, id) tuple, parent key
+        is None for root nodes, position is optional - last by default):
+            ('add', parent_key, node[, position]) - node with its children,
+            ('update', key, {'title': ..., 'url': ..., ...}) - attributes,
+            ('move', key, parent_key[, position]),
+            ('remove', key) - node with its children.
+        Levels and Jump urls are recalculated only for affected nodes,
+        paths - only for affected entries, index and lookups are rebuilt.
+        """
+        menuconf = (menuconf if isinstance(menuconf, dict) else
+                    self.get_menuconf(menuconf))
+        if self.labelled(menuconf):
+            # structure is patched, label tables are built by its version
+            with override(settings.LANGUAGE_CODE):
+                return self.patch(menuconf, ops)
+
+        cache_key = self.cache_key(menuconf=menuconf)
+        nodes = self.get_cached_nodes(menuconf, cache_key)
+        if nodes is None:
+            return None
+
+        # cached nodes can be used by other requests (shared), so patch copy
+        nodes = copy.deepcopy(nodes)
+        keys = dict(((i.namespace, i.id,), i) for i in nodes['index'])
+        paths, affected, recompute = nodes['paths'], [], set()
+
+        def get(key):
+            if key is None:
+                return None
+            if key not in keys:
+                raise ValueError('Menus patch: node %s not found.' % (key,))
+            return keys[key]
+
+        def detach(node):
+            siblings = node.parent.children if node.parent else nodes['nodes']
+            siblings.remove(node)
+
+        def attach(node, parent, position=None):
+            siblings = parent.children if parent else nodes['nodes']
+            siblings.insert(len(siblings) if position is None else position,
+                            node)
+            node.parent = parent
+            parent and affected.append(parent)
+
+        def winner(node, path=None):
+            # paths entry of node should be recalculated by full search
+            path = path or self.get_path(node)
+            if path and paths.get(path, None) is node:
+                recompute.add(path)
+
+        for op in ops:
+            action, key, args = op[0], op[1], op[2:]
+            if action == 'add':
+                node, parent = args[0], get(key)
+                node.namespace = node.namespace or (parent and parent.namespace)
+                if not node.namespace:
+                    raise ValueError('Menus patch: node namespace required.')
+                attach(node, parent, *args[1:])
+                for i in tgenerator([node]):
+                    i.namespace = i.namespace or node.namespace
+                    keys[(i.namespace, i.id,)] = i
+                    affected.append(i)
+            elif action == 'update':
+                node = get(key)
+                values = dict(args[0])
+                winner(node)
+                if 'url' in values:
+                    node.url_original = values['url']
+                for name, value in values.items():
+                    setattr(node, name, value)
+                affected.append(node)
+            elif action == 'move':
+                node, parent = get(key), get(args[0])
+                item = parent
+                while item is not None:
+                    if item is node:
+                        raise ValueError('Menus patch: node %s can not be'
+                                         ' moved into itself.' % (key,))
+                    item = item.parent
+                node.parent and affected.append(node.parent)
+                detach(node)
+                attach(node, parent, *args[1:])
+                for i in tgenerator([node]):
+                    winner(i)
+                    affected.append(i)
+            elif action == 'remove':
+                node = get(key)
+                node.parent and affected.append(node.parent)
+                detach(node)
+                for i in tgenerator([node]):
+                    winner(i)
+                    del keys[(i.namespace, i.id,)]
+            else:
+                raise ValueError('Menus patch: invalid operation (%s).'
+                                 % action)
+
+        # removed nodes should not be processed
+        affected = [i for i in affected if keys.get((i.namespace, i.id,),
+                                                     None) is i]
+
+        # patched nodes have no content fingerprint (timestamp version)
+        nodes.pop('fingerprint', None)
+        for node in affected:
+            while node is not None and node.fingerprint is not None:
+                node.fingerprint, node = None, node.parent
+
+        # reindex tree, rebuild arrays and lookups
+        meta = {'rebuild_mode': False,}
+        self.index_nodes(nodes, meta)
+        nodes.update(self.build_lookups(nodes['index']))
+
+        modifiers = menuconf['MODIFIERS']['default']
+        if 'Level' in modifiers:
+            for node in sorted(affected, key=lambda i: i.index):
+                node.level = node.level_original = (
+                    node.parent.level + 1 if node.parent else 0)
+        if 'Jump' in modifiers:
+            self.patch_jump_urls(affected)
+        self.patch_paths(nodes, affected, recompute)
+
+        nodes['version'] = self.new_version(nodes)
+        self.set_cached_nodes(menuconf, cache_key, nodes)
+        return nodes
+
+    def patch_jump_urls(self, nodes):
+        """
+        Update Jump urls of nodes and their jump ancestors bottom-up
+        (reversed pre-order), so jump targets are updated before parents.
+        """
+        chains, done = [], set()
+        for node in nodes:
+            while node is not None and node.index not in done:
+                done.add(node.index)
+                chains.append(node)
+                node = node.parent
+                if node is not None and not node.data.get('jump', False):
+                    break
+
+        for node in sorted(chains, key=lambda i: i.index, reverse=True):
+            if node.children and node.data.get('jump', False):
+                node.url = node.children[0].url
+            else:
+                node.url = node.url_original
+
+    def patch_paths(self, nodes, affected, recompute):
+        """
+        Update paths entries of affected nodes, entries in recompute set
+        are searched in full tree (same results as build_paths).
+        """
+        paths = nodes['paths']
+        for path in recompute:
+            paths.pop(path, None)
+        if recompute:
+            for node in nodes['index']:
+                path = self.get_path(node)
+                if path in recompute and (path not in paths or
+                                          self.compare_paths(node,
+                                                             paths[path])):
+                    paths[path] = node
+
+        for node in sorted(set(affected), key=lambda i: i.index):
+            path = self.get_path(node)
+            if not path or path in recompute:
+                continue
+            current = paths.get(path, None)
+            if current is None or current is node:
+                paths[path] = node
+            elif (self.compare_paths(node, current) if
+                  node.index > current.index else
+                  not self.compare_paths(current, node)):
+                paths[path] = node
+
     def apply_modifiers(self, menuconf, nodes, request, modify_event=DEFAULT,
                         modifiers=None, meta=None, kwargs=None):
         """
@@ -164,7 +1128,9 @@ class Processor(object):
         Params:
             nodes - dict with nodes and selected node value, also can
                 contain any other user information (by default it contains
-                paths for indexed search of selected node). Nodes structure
+                paths for indexed search of selected node, index list and
+                per-request state overlay - NodesState instance, which
+                holds any request related values). Nodes structure
                 see in get_nodes method.
 
             modify_event - event, after which modifiers called. Builtin values:
@@ -182,7 +1148,8 @@ class Processor(object):
                 modified_ancestors - should be set to True by modifier,
                     if any parent value modified
                 modified_descendants - should be set to True by modifier,
-                    if any children value modified
+                    if any children value modified, or to set of modified
+                    root nodes indexes (see Modifier.modified_descendants)
 
                 User can provide any other keys to your own modifiers.
         """
@@ -194,19 +1161,30 @@ class Processor(object):
             'modified_ancestors': False, 'modified_descendants': False,
         }, **dict(meta or {}, modify_event=modify_event))
 
-        # get (cached) value of modifiers by menuconf name and modifiers group
+        # get compiled modifiers by menuconf name, modifiers group and event
         modifconf = modifiers or 'default'
-        modifname = '%s.%s' % (menuconf['NAME'], modifconf,)
-        modifiers = self._modifiers.get(modifname, None)
-        if not modifiers:
-            modifiers = [self.registry.modifiers[mod]
-                         for mod in menuconf['MODIFIERS'][modifconf]]
-            self._modifiers[modifname] = modifiers
-
-        # process
-        for modifier in modifiers:
-            if modify_event & modifier.modify_event:
+        modifiers = self._modifiers.get((menuconf['NAME'], modifconf,), None)
+        if modifiers is None:
+            # not compiled menuconf value
+            modifiers = self.compile_modifiers(
+                menuconf['MODIFIERS'][modifconf])
+        modifiers = (modifiers[modify_event] if modify_event in modifiers else
+                     [i for i in modifiers[None]
+                      if modify_event & i.modify_event])
+
+        # process (with durations if request is traced)
+        trace = getattr(getattr(request, 'nodes', None), 'trace', None)
+        if trace is None:
+            for modifier in modifiers:
                 modifier.modify(request, nodes, meta, **kwargs)
+            return
+
+        durations = trace.menu(menuconf['NAME'])['modifiers']
+        for modifier in modifiers:
+            start = time.time()
+            modifier.modify(request, nodes, meta, **kwargs)
+            name = modifier.__class__.__name__
+            durations[name] = durations.get(name, 0.0) + time.time() - start
 
     # raw menus nodes list generator
     def build_nodes(self, request, menus):
@@ -254,16 +1232,151 @@ class Processor(object):
 
         return [i for i in final if not i.parent]
 
+    def index_nodes(self, nodes, meta):
+        """
+        Set node.index value (position in pre-order list) to each node,
+        it is key of any per-request state value. In rebuild mode only
+        new nodes (without index) are indexed.
+        Also build flat arrays for vectorized filtering (if enabled).
+        """
+        if not meta['rebuild_mode']:
+            nodes['index'] = list(tgenerator(nodes['nodes']))
+            for index, node in enumerate(nodes['index']):
+                node.index = index
+            if msettings.MASK_ENGINE and numpy:
+                nodes['arrays'] = TreeArrays(nodes['index'])
+            return
+
+        # arrays are not valid for rebuilt tree, use pure python
+        nodes.pop('arrays', None)
+
+        index = nodes['index']
+        for node in tgenerator(nodes.get('rebuilt_nodes', [])):
+            if node.index is None:
+                node.index = len(index)
+                index.append(node)
+
     def post_build_data_handler(self, menuconf, nodes, request, meta):
         """
-        By default updates nodes with {"paths": paths,}.
+        By default updates nodes with {"paths": paths, "reverse_ids": ...,
+        "namespaces": ..., "auth_required": ..., "jumps": ..., "ids": ...,}.
         Paths using for indexed search of selected node. If you will find
         faster method, you can override all behaviour, including selected node
-        detection.
+        detection. Reverse ids, namespaces and auth_required are lookup
+        indexes for Root, Namespace, AuthVisibility and Jump modifiers and
+        ids (with reverse ids and paths) for get_node (see build_lookups),
+        they are removed in rebuild mode, so full tree search is used.
         All result data must be serializable.
         """
         if not meta['rebuild_mode']:
             nodes.update({'paths': self.build_paths(nodes['nodes']),})
+            nodes.update(self.build_lookups(nodes['index']))
+        else:
+            nodes.pop('reverse_ids', None)
+            nodes.pop('namespaces', None)
+            nodes.pop('auth_required', None)
+            nodes.pop('jumps', None)
+            nodes.pop('ids', None)
+
+    def build_lookups(self, index):
+        """
+        Build lookup indexes by indexed nodes list:
+            reverse_ids - {reverse_id: [node.index, ...]} in pre-order,
+            namespaces - {namespace: {"entries": [node.index, ...],
+                                      "pure": bool, "size": int}}
+            auth_required - [node.index, ...] of auth required nodes without
+                            auth required ancestors in pre-order,
+            jumps - {node.index: top.index} of Jump chains members,
+            ids - {(namespace, id): node.index} with (None, id) keys of
+                  first node with id in pre-order
+        where entries are roots of namespace sub-forest (nodes without
+        parent in same namespace) in Namespace (tfilter) order and "pure"
+        means that sub-forest does not contain nodes from other namespaces.
+        """
+        reverse_ids, namespaces, auth_required, covered = {}, {}, [], set()
+        jumps, ids = {}, {}
+        for node in index:
+            ids[(node.namespace, node.id,)] = node.index
+            ids.setdefault((None, node.id,), node.index)
+            if node.children and node.data.get('jump', False):
+                jumps[node.children[0].index] = jumps.get(node.index,
+                                                          node.index)
+
+            if node.parent is not None and node.parent.index in covered:
+                covered.add(node.index)
+            elif node.data.get('auth_required', False):
+                auth_required.append(node.index)
+                covered.add(node.index)
+
+            reverse_id = node.data.get('reverse_id', None)
+            if reverse_id:
+                reverse_ids.setdefault(reverse_id, []).append(node.index)
+
+            value = namespaces.setdefault(node.namespace, {
+                'entries': [], 'pure': True, 'size': 0,})
+            value['size'] += 1
+            if not node.parent or node.parent.namespace != node.namespace:
+                value['entries'].append(node.index)
+            for child in node.children:
+                if child.namespace != node.namespace:
+                    value['pure'] = False
+
+        # existing root nodes go first (see utils.tfilter)
+        for value in namespaces.values():
+            value['entries'].sort(key=lambda i: (bool(index[i].parent), i))
+
+        return {'reverse_ids': reverse_ids, 'namespaces': namespaces,
+                'auth_required': auth_required, 'jumps': jumps, 'ids': ids,}
+
+    # Nodes lookup
+    # ------------
+    def get_node(self, request, id=None, namespace=None, reverse_id=None,
+                 url=None, menuconf=None):
+        """
+        Get node of request nodes (PER_REQUEST) by id (and namespace),
+        reverse_id or url without tree traversal (by lookup indexes, see
+        build_lookups). Node is returned as NodeProxy (with request state
+        values) or None if it is not found or hidden.
+        """
+        menuconf = self.menuconf(request, name=menuconf)
+        self.get_nodes(menuconf, request, init_only=True)
+        nodes = request.nodes.menus[menuconf['NAME']]
+        node = self.find_node(nodes, id=id, namespace=namespace,
+                              reverse_id=reverse_id, url=url)
+        state = nodes['state']
+        if node is None or state.get_root(node) is None:
+            return None
+        return NodeProxy(node, state)
+
+    def find_node(self, nodes, id=None, namespace=None, reverse_id=None,
+                  url=None):
+        """
+        Find node in nodes data by lookup indexes (or by tree search if
+        indexes are not available - in rebuild mode).
+        """
+        if url is not None:
+            # empty path is not indexed in paths, it is searched in roots
+            path = urlparse.urlparse(url).path.strip('/')
+            return (nodes['paths'].get(path, None) if path else
+                    next((i for i in nodes['nodes']
+                          if self.get_path(i) == ''), None))
+
+        if reverse_id is not None:
+            lookup, key = nodes.get('reverse_ids', None), reverse_id
+            check = lambda i: i.data.get('reverse_id', None) == reverse_id
+        elif id is not None:
+            lookup, key = nodes.get('ids', None), (namespace, id,)
+            check = lambda i: i.id == id and namespace in (None, i.namespace)
+        else:
+            return None
+
+        if lookup is None:
+            return next((i for i in tgenerator(nodes['nodes']) if check(i)),
+                        None)
+        value = lookup.get(key, None)
+        if isinstance(value, list):
+            value = value[0] if value else None
+        return None if value is None else nodes['index'][value]
 
     # Selection speedup by indexed search (with paths dict)
     # -----------------------------------------------------
@@ -302,9 +1415,56 @@ class Processor(object):
                 paths[path] = node
 
     def search_selected(self, request, data):
-        """Search selected node (indexed search in paths)."""
-        nodes, paths, path = (data['nodes'], data['paths'],
-                              request.path.strip('/').split('/'),)
+        """
+        Search selected node (indexed search in paths). Results of cached
+        (not rebuilt) nodes are cached in process by menuconf name (data
+        "menuconf" value), nodes version, path and visibility class (see
+        selection_cache_get).
+        """
+        menuconf = data.get('menuconf', None)
+        key = (menuconf and data.get('version', None) and
+               not data.get('rebuilt', False) and
+               (menuconf, data['version'], request.path.strip('/'),
+                self.visibility_class(request),))
+        if key:
+            value = self.selection_cache_get(key)
+            if value is not False:
+                if value is None:
+                    return None, None
+                index = data['index']
+                data['state'].selected = value[-1]
+                return index[value[-1]], [index[i] for i in value]
+
+        selected, chain = self._search_selected(request, data)
+        if key:
+            self.selection_cache_set(key, selected and tuple(i.index
+                                                             for i in chain))
+        return selected, chain
+
+    def selection_cache_get(self, key):
+        """
+        Get cached selection value: chain indexes (selected is last),
+        None if nothing is selected or False if value is not cached.
+        """
+        with self._selections_lock:
+            value = self._selections.pop(key, False)
+            if value is not False:
+                self._selections[key] = value
+        return value
+
+    def selection_cache_set(self, key, value):
+        if msettings.SELECTION_CACHE_SIZE <= 0:
+            return
+        with self._selections_lock:
+            self._selections.pop(key, None)
+            while len(self._selections) >= msettings.SELECTION_CACHE_SIZE:
+                self._selections.popitem(last=False)
+            self._selections[key] = value
+
+    def _search_selected(self, request, data):
+        nodes, paths, state, path = (data['nodes'], data['paths'],
+                                     data['state'],
+                                     request.path.strip('/').split('/'),)
 
         # check existance of path starting from current path down to its first
         # ancestor: on "/a/b/c/" page look for "a/b/c" or "a/b" or "a" in paths
@@ -319,11 +1479,12 @@ class Processor(object):
 
                 # check selected for existance in morphed by
                 # per_request modifiers nodes list (auth visibility, ect.)
-                if not chain[0] in nodes:
+                if not chain[0] in nodes or [i for i in chain
+                                             if i.index in state.hidden]:
                     continue
 
                 # mark node as selected and return
-                selected.selected = True
+                state.selected = selected.index
 
                 return selected, chain
         return None, None
@@ -398,3 +1559,47 @@ class Processor(object):
 
         if errors:
             raise ImproperlyConfigured('\n'.join(errors.values()))
+
+        self.compile_menus(MENUS)
+
+    def compile_menus(self, menus):
+        """
+        Compile prepared menus settings once: read-only menuconf values
+        (selected and not selected variants), routes and modifiers by
+        menuconf name, modifiers group and modify event. Compiled values
+        are never changed, so they are safely shared between threads.
+        """
+        menuconfs, modifiers, routes = {}, {}, []
+        for name, value in menus.items():
+            value = dict(value)
+            value.update(
+                MENUS=tuple(value['MENUS']),
+                MODIFIERS=MenuConf((k, tuple(v or ()),)
+                                   for k, v in value['MODIFIERS'].items()))
+            for selected in (False, True,):
+                menuconfs[(name, selected,)] = MenuConf(value,
+                                                        SELECTED=selected)
+            for group, names in value['MODIFIERS'].items():
+                modifiers[(name, group,)] = self.compile_modifiers(names)
+            if value.get('ROUTE', None):
+                routes.append((name, re.compile(value['ROUTE']),))
+
+        self._menuconfs, self._modifiers = menuconfs, modifiers
+        self._ROUTES = routes or None
+
+    def mutating(self, menuconf, modifiers=None, kwargs=None):
+        """Check that any DEFAULT modifier of group mutates nodes (kwargs)."""
+        group, kwargs = modifiers or 'default', kwargs or {}
+        compiled = self._modifiers.get((menuconf['NAME'], group,), None)
+        if compiled is None:
+            compiled = self.compile_modifiers(menuconf['MODIFIERS'][group])
+        return any(i.mutating(kwargs) for i in compiled[DEFAULT])
+
+    def compile_modifiers(self, names):
+        """Modifiers instances by modify event ({event: [...], None: all})."""
+        modifiers = tuple(self.registry.modifiers[i] for i in names or ())
+        compiled = dict((event, tuple(i for i in modifiers
+                                      if event & i.modify_event),)
+                        for event in (ONCE, PER_REQUEST, POST_SELECT, DEFAULT,))
+        compiled[None] = modifiers
+        return compiled
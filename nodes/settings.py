@@ -43,6 +43,9 @@ DEFAULT_SCHEME = {
 DEFAULT_META_DATA = 'nodes.base.MetaData'
 DEFAULT_PROCESSOR = 'nodes.processor.Processor'
 DEFAULT_NAVIGATION_NODE = 'nodes.base.NavigationNode'
+# node.data keys used by builtin modifiers (kept in cached nodes tree)
+DEFAULT_TREE_DATA_KEYS = ('jump', 'auth_required', 'reverse_id', 'weight',
+                          'visible_in_chain',)
 
 MENU_APPS           = getattr(settings, 'MENUS_APPS', None)
 BUILTIN_MODIFIERS   = getattr(settings, 'MENUS_BUILTIN_MODIFIERS', True)
@@ -51,6 +54,21 @@ META_DATA           = getattr(settings, 'MENUS_META_DATA', DEFAULT_META_DATA)
 NAVIGATION_NODE     = getattr(settings, 'MENUS_NAVIGATION_NODE',
                               DEFAULT_NAVIGATION_NODE)
 MENUS               = getattr(settings, 'MENUS', None)
+MASK_ENGINE         = getattr(settings, 'MENUS_MASK_ENGINE', True)
+RENDER_SPECS        = getattr(settings, 'MENUS_RENDER_SPECS', {})
+SHARED_TREES_DIR    = getattr(settings, 'MENUS_SHARED_TREES_DIR', None)
+BRANCH_STORAGE      = getattr(settings, 'MENUS_BRANCH_STORAGE', False)
+COMPRESS_THRESHOLD  = getattr(settings, 'MENUS_COMPRESS_THRESHOLD', None)
+CHUNK_SIZE          = getattr(settings, 'MENUS_CHUNK_SIZE', 1000000)
+CHECK_PAYLOAD       = getattr(settings, 'MENUS_CHECK_PAYLOAD', False)
+TRACE_DUMP          = getattr(settings, 'MENUS_TRACE_DUMP', None)
+REBUILD_DELAY       = getattr(settings, 'MENUS_REBUILD_DELAY', 1.0)
+SELECTION_CACHE_SIZE = getattr(settings, 'MENUS_SELECTION_CACHE_SIZE', 10000)
+BUILT_CACHE_SIZE    = getattr(settings, 'MENUS_BUILT_CACHE_SIZE', 100)
+# None - node.data is stored in tree, True - DEFAULT_TREE_DATA_KEYS
+TREE_DATA_KEYS      = getattr(settings, 'MENUS_TREE_DATA_KEYS', None)
+if TREE_DATA_KEYS is True:
+    TREE_DATA_KEYS = DEFAULT_TREE_DATA_KEYS
 
 
 
@@ -1,8 +1,30 @@
 import re
 from django import template
+from django.utils.safestring import mark_safe
 from nodes.utils.template import inclusion_tag, get_from_context
+from nodes.utils.render import get_menu_renderer
 from nodes import registry
 
+def get_menu_nodes(request, from_level, to_level, extra_inactive,
+                   extra_active, show_invisible, show_inactive_branch,
+                   menuconf, modifiers, extra_active_mode, **kwargs):
+    """get menuconf and nodes tree for show_menu like tags"""
+    kwargs.update(cut_levels={
+        'from_level': from_level,
+        'to_level': to_level,
+        'extra_inactive': extra_inactive,
+        'extra_active': extra_active,
+        'extra_active_mode': extra_active_mode,
+        'show_invisible': show_invisible,
+        'show_inactive_branch': show_inactive_branch,
+    })
+
+    # get result nodes tree
+    menuconf = registry.processor.menuconf(request, name=menuconf)
+    nodes = registry.processor.get_nodes(menuconf, request, readonly=True,
+                                         modifiers=modifiers, **kwargs)
+    return menuconf, nodes, kwargs
+
 def show_menu(context, from_level=0, to_level=100,
               extra_inactive=0, extra_active=100,
               template=None, show_invisible=False, show_inactive_branch=False,
@@ -27,25 +49,15 @@ def show_menu(context, from_level=0, to_level=100,
     if not request:
         return {'template': None,}
 
-    kwargs.update(cut_levels={
-        'from_level': from_level,
-        'to_level': to_level,
-        'extra_inactive': extra_inactive,
-        'extra_active': extra_active,
-        'extra_active_mode': extra_active_mode,
-        'show_invisible': show_invisible,
-        'show_inactive_branch': show_inactive_branch,
-    })
-
-    # get result nodes tree
-    menuconf = registry.processor.menuconf(request, name=menuconf)
-    nodes = registry.processor.get_nodes(menuconf, request,
-                                         modifiers=modifiers, **kwargs)
+    menuconf, nodes, kwargs = get_menu_nodes(
+        request, from_level, to_level, extra_inactive, extra_active,
+        show_invisible, show_inactive_branch, menuconf, modifiers,
+        extra_active_mode, **kwargs)
     if not nodes:
         return {'template': None,}
 
     context.update({
-        'children': nodes['nodes'],
+        'children': nodes['state'].wrap(nodes['nodes']),
         'selected': nodes['selected'],
         'template': template,
         'menuconf': menuconf,
@@ -53,6 +65,49 @@ def show_menu(context, from_level=0, to_level=100,
     })
     return context
 
+def show_menu_fast(context, from_level=0, to_level=100,
+                   extra_inactive=0, extra_active=100,
+                   spec=None, show_invisible=False, show_inactive_branch=False,
+                   menuconf=None, modifiers=None, extra_active_mode=0,
+                   **kwargs):
+    """
+    render a nested list of all children of the pages by compiled renderer
+    (see nodes.utils.render), arguments are same as in show_menu except:
+    - spec: render spec name from MENUS_RENDER_SPECS setting (instead of template)
+    """
+    request = context.get('request', None)
+    if not request:
+        return mark_safe(u'')
+
+    menuconf, nodes, kwargs = get_menu_nodes(
+        request, from_level, to_level, extra_inactive, extra_active,
+        show_invisible, show_inactive_branch, menuconf, modifiers,
+        extra_active_mode, **kwargs)
+    if not nodes:
+        return mark_safe(u'')
+
+    return get_menu_renderer(spec)(nodes['nodes'], nodes['state'])
+
+def get_node(context, id=None, namespace=None, reverse_id=None, url=None,
+             menuconf=None):
+    """
+    get node (with request state values) by id (and namespace), reverse_id
+    or url: {% get_node reverse_id="news" as node %}
+    """
+    request = context.get('request', None)
+    if not request:
+        return None
+    return registry.processor.get_node(request, id=id, namespace=namespace,
+                                       reverse_id=reverse_id, url=url,
+                                       menuconf=menuconf)
+
+def node_url(context, id=None, namespace=None, reverse_id=None, url=None,
+             menuconf=None):
+    """url of node found as in get_node or empty string"""
+    node = get_node(context, id=id, namespace=namespace,
+                    reverse_id=reverse_id, url=url, menuconf=menuconf)
+    return node.url if node else ''
+
 def load_menu(parser, token):
     """loads menu, set data to request.meta first"""
     class LoadMenuNode(template.Node):
@@ -65,3 +120,6 @@ def load_menu(parser, token):
 register = template.Library()
 load_menu = register.tag(load_menu)
 inclusion_tag(register, takes_context=True)(show_menu)
+register.simple_tag(takes_context=True)(show_menu_fast)
+register.simple_tag(takes_context=True)(get_node)
+register.simple_tag(takes_context=True)(node_url)
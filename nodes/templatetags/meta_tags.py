@@ -1,6 +1,19 @@
 from django import template
 from django.utils.safestring import mark_safe
 from nodes.utils.template import inclusion_tag, get_from_context
+from nodes import registry
+
+def load_meta(parser, token):
+    """
+    loads metadata only (for pages without menus), uses selection index
+    instead of nodes loading (see Processor.load_selection)
+    """
+    class LoadMetaNode(template.Node):
+        def render(self, context):
+            request = get_from_context(context, 'request')
+            registry.processor.load_selection(request)
+            return ''
+    return LoadMetaNode()
 
 def show_meta_title(context, main_title='', template="metas/title.html"):
     """render a meta title list into requested template"""
@@ -58,6 +71,7 @@ def show_meta_description(context, main_description='', with_tag=False, as_defau
     return mark_safe(description)
 
 register = template.Library()
+load_meta = register.tag(load_meta)
 register.simple_tag(takes_context=True)(show_meta_selected)
 register.simple_tag(takes_context=True)(show_meta_keywords)
 register.simple_tag(takes_context=True)(show_meta_description)
@@ -0,0 +1,1142 @@
+import json
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import Http404, HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.utils.safestring import SafeText
+from django.utils.translation import get_language, override
+from . import registry, settings as msettings
+from .base import Menu, NavigationNode, NodesState, PER_REQUEST
+from .middleware import MenusTraceMiddleware
+from .processor import Processor
+from .templatetags.menu_tags import node_url, show_menu_fast
+from .utils import render, tgenerator
+from .utils.rebuild import Rebuilder
+from .utils.replay import replay
+from .utils.shared import SharedTree
+from .utils.stress import process, stress
+from .views import menu_json, sitemap
+
+
+class DynamicNode(NavigationNode):
+    """Node with per-request children (rebuild on selection)."""
+
+    def on_selected(self, menuconf, nodes, request):
+        children = [NavigationNode('Item %d' % i, '%sitem%d/' % (self.url, i),
+                                   1000 + i) for i in range(2)]
+        for node in children:
+            node.parent, node.namespace = self, self.namespace
+            node.index = None
+            self.children.append(node)
+        nodes['rebuilt_nodes'] = children
+        processor = registry.processor
+        processor.merge_paths(nodes['paths'], processor.build_paths(children))
+        return True
+
+
+class TestMenu(Menu):
+    namespace = 'TestMenu'
+
+    def get_nodes(self, request):
+        return [
+            NavigationNode('Home', '/', 1),
+            NavigationNode('Jump', '/j/', 2, data={'jump': True,}),
+            NavigationNode('Private', '/j/a/', 3, parent=2,
+                           data={'auth_required': True,}),
+            NavigationNode('Public', '/j/b/', 4, parent=2,
+                           data={'meta_title': 'Public page',}),
+            DynamicNode('Dynamic', '/dynamic/', 5),
+            NavigationNode('Secret', '/s/', 6),
+            NavigationNode('Secret page', '/s/a/', 7, parent=6,
+                           data={'auth_required': True,}),
+        ]
+
+
+class PatchMenu(Menu):
+    namespace = 'PatchMenu'
+    items = ()  # (title, url, id, parent id, data) values
+    labels = {}  # get_labels value of not default language
+
+    def get_labels(self, request):
+        return self.labels if get_language() != 'en-us' else {}
+
+    def get_nodes(self, request):
+        # optional sixth item value is node visibility
+        return [NavigationNode(i[0], i[1], i[2], parent=i[3], data=dict(i[4]),
+                               visible=i[5] if len(i) > 5 else True)
+                for i in self.items]
+
+
+class SideMenu(Menu):
+    namespace = 'SideMenu'
+
+    def get_nodes(self, request):
+        return [
+            NavigationNode('Side', '/side/', 1),
+            NavigationNode('Side public', '/j/b/', 2, parent=1),
+        ]
+
+
+class SelectedProcessor(Processor):
+    """Processor with old search_selected signature override."""
+    paths = []
+
+    def search_selected(self, request, data):
+        self.paths.append(request.path)
+        return super(SelectedProcessor, self).search_selected(request, data)
+
+
+class LimitedCache(LocMemCache):
+    """Cache, which silently ignores values larger than limit (pickled)."""
+    limit = 300
+
+    def set(self, key, value, *args, **kwargs):
+        if len(pickle.dumps(value, 2)) <= self.limit:
+            super(LimitedCache, self).set(key, value, *args, **kwargs)
+
+    def set_many(self, data, *args, **kwargs):
+        for key, value in data.items():
+            self.set(key, value, *args, **kwargs)
+
+
+class MenusTestCase(TestCase):
+    """Processor with test menus and settings (restored after test)."""
+    settings = {
+        'MENU_APPS': [],
+        'MENUS': {
+            'default': {'MENUS': ['TestMenu',],},
+        },
+    }
+
+    def setUp(self):
+        saved = (registry.menus, registry.modifiers, registry.discovered,
+                 registry._processor,)
+        self.addCleanup(self.restore, saved)
+        self.set_settings(**self.settings)
+        self.reset_processor()
+
+    def restore(self, saved):
+        (registry.menus, registry.modifiers, registry.discovered,
+         registry._processor,) = saved
+        cache.clear()
+
+    def set_settings(self, **values):
+        for name, value in values.items():
+            self.addCleanup(setattr, msettings, name,
+                            getattr(msettings, name))
+            setattr(msettings, name, value)
+
+    def reset_processor(self, clear=True):
+        registry.menus, registry.modifiers, registry._processor = {}, {}, None
+        registry.discovered = False
+        registry.register_menu(TestMenu)
+        registry.register_menu(SideMenu)
+        registry.register_menu(PatchMenu)
+        clear and cache.clear()
+        return registry.processor
+
+    def request(self, path, user=None):
+        request = RequestFactory().get(path)
+        request.user = user or AnonymousUser()
+        return request
+
+    def get_nodes(self, path, user=None, **kwargs):
+        request = self.request(path, user)
+        return request, registry.processor.get_nodes(None, request, **kwargs)
+
+
+class SelectionTestCase(MenusTestCase):
+    def check_dynamic(self):
+        for path in ('/dynamic/item1/', '/dynamic/', '/dynamic/item0/',):
+            request, nodes = self.get_nodes(path)
+            self.assertEqual(nodes['selected'].url, path)
+            self.assertEqual(request.nodes.title[-1],
+                             nodes['selected'].title)
+        request, nodes = self.get_nodes('/dynamic/')
+        self.assertEqual([i.title for i in nodes['selected'].children],
+                         ['Item 0', 'Item 1',])
+
+    def test_on_selected_cold_build(self):
+        # requests after build get process-shared nodes (see create_nodes)
+        for i in range(2):
+            cache.clear()
+            self.check_dynamic()
+            for nodes in registry.processor._built.values():
+                self.assertNotIn('dynamic/item0', nodes['paths'])
+
+    def test_selection_cache(self):
+        # cached selections are same as not cached (baseline) ones
+        self.set_settings(PROCESSOR='nodes.tests.SelectedProcessor')
+        self.addCleanup(setattr, SelectedProcessor, 'paths', [])
+        paths = ('/j/b/', '/j/b/x/', '/none/', '/j/a/', '/s/a/',)
+        users = (None, User(username='test'),)
+        results = []
+        for size in (0, 100,):
+            self.set_settings(SELECTION_CACHE_SIZE=size)
+            self.reset_processor()
+            for i in range(2):
+                for path in paths:
+                    for user in users:
+                        request, nodes = self.get_nodes(path, user)
+                        results.append((size, path, user,
+                                        nodes['selected'] and
+                                        nodes['selected'].url,
+                                        request.nodes.title,))
+            self.assertEqual(len(registry.processor._selections),
+                             size and len(paths) * len(users))
+        baseline = [i[1:] for i in results if not i[0]]
+        self.assertEqual([i[1:] for i in results if i[0]], baseline)
+        self.assertEqual([i[2] for i in baseline[:3]], ['/j/b/',] * 3)
+        self.assertEqual(len(SelectedProcessor.paths), len(results))
+
+    def test_on_selected_shared_trees(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.set_settings(SHARED_TREES_DIR=path)
+        self.reset_processor()
+        self.check_dynamic()
+        # next process (mmap-loaded tree)
+        self.reset_processor(clear=False)
+        self.check_dynamic()
+
+
+class StateTestCase(MenusTestCase):
+    def test_state_applied(self):
+        request, nodes = self.get_nodes('/j/b/')
+        jump = [i for i in nodes['nodes'] if i.id == 2][0]
+        # anonymous user: auth required child is hidden, jump to next one
+        self.assertEqual(jump.url, '/j/b/')
+        self.assertEqual([i.title for i in jump.children], ['Public',])
+        self.assertTrue(nodes['selected'].selected)
+        self.assertTrue(jump.ancestor)
+        self.assertFalse(jump.selected)
+
+        request, nodes = self.get_nodes('/j/b/', User(username='test'))
+        jump = [i for i in nodes['nodes'] if i.id == 2][0]
+        self.assertEqual(jump.url, '/j/a/')
+
+    def test_leaf_lazy(self):
+        # leaf of not loaded root is read before its children
+        self.set_settings(BRANCH_STORAGE=True)
+        self.reset_processor()
+        self.get_nodes('/j/b/', User(username='test'))
+        request, nodes = self.get_nodes('/j/b/')
+        secret = [i for i in nodes['nodes'] if i.id == 6][0]
+        loader = nodes['index'].loader
+        self.assertNotIn(secret.children.position, loader.loaded)
+        self.assertTrue(secret.leaf)
+        self.assertTrue(nodes['state'].is_leaf(secret.index))
+        self.assertNotIn(secret.children.position, loader.loaded)
+        self.assertEqual(list(secret.children), [])
+
+        request, nodes = self.get_nodes('/j/b/', User(username='test'))
+        secret = [i for i in nodes['nodes'] if i.id == 6][0]
+        self.assertFalse(secret.leaf)
+
+    def test_paths_of_copy(self):
+        for storage in (False, True,):
+            self.set_settings(BRANCH_STORAGE=storage)
+            self.reset_processor()
+            self.get_nodes('/j/')
+            request, nodes = self.get_nodes('/j/b/')
+            jump = [i for i in nodes['nodes'] if i.id == 2][0]
+            self.assertIs(nodes['paths']['j/b'], nodes['selected'])
+            self.assertIs(nodes['paths']['j'], jump)
+            self.assertTrue(nodes['paths']['j'].ancestor)
+
+            # changes of copy paths are not shared
+            nodes['paths']['j'] = None
+            request, nodes = self.get_nodes('/j/b/')
+            self.assertEqual(nodes['paths']['j'].id, 2)
+
+    def test_modified_roots(self):
+        processor = registry.processor
+        request = self.request('/')
+        menuconf = processor.get_menuconf('default')
+        nodes = processor.create_nodes(menuconf, request, processor.cache_key(
+            request=request, menuconf=menuconf))
+        nodes.pop('jumps')  # resolve jumps by tree walk
+
+        for lookup in (True, False,):
+            data = dict(nodes, state=NodesState())
+            lookup or data.pop('auth_required')
+            meta = {'modify_event': PER_REQUEST, 'rebuild_mode': False,
+                    'modified_descendants': False,}
+            for name in ('AuthVisibility', 'Jump',):
+                registry.modifiers[name].modify(request, data, meta)
+            # jump and secret roots
+            self.assertEqual(meta['modified_descendants'], set([1, 5]))
+            self.assertEqual(data['state'].urls, {1: '/j/b/',})
+
+        # not known roots of other modifiers mark all ones
+        modifier = registry.modifiers['Jump']
+        modifier.modified_descendants(meta)
+        self.assertIs(meta['modified_descendants'], True)
+        modifier.modified_descendants(meta, [0])
+        self.assertIs(meta['modified_descendants'], True)
+
+    def test_state_applied_lazy(self):
+        # branches of lazy nodes get state values on loading
+        self.set_settings(BRANCH_STORAGE=True)
+        self.reset_processor()
+        self.get_nodes('/j/b/')
+        self.test_state_applied()
+
+
+class BuiltCacheTestCase(MenusTestCase):
+    def test_fingerprint_attributes(self):
+        processor = registry.processor
+        menuconf = processor.get_menuconf('default')
+        nodes = [NavigationNode('Home', '/', 1)]
+        value = processor.fingerprint(menuconf, nodes)
+        nodes[0].icon = 'home'  # custom node attribute
+        self.assertNotEqual(processor.fingerprint(menuconf, nodes), value)
+        del nodes[0].icon
+        nodes[0].index = 0
+        self.assertEqual(processor.fingerprint(menuconf, nodes), value)
+
+    def test_size(self):
+        self.set_settings(BUILT_CACHE_SIZE=2)
+        processor = registry.processor
+        for key in ('a', 'b', 'a', 'c',):
+            processor.built_cache_set(key, {'key': key,})
+        self.assertEqual(list(processor._built), ['a', 'c',])
+        self.assertEqual(processor.built_cache_get('b'), None)
+
+
+class ReadonlyTestCase(MenusTestCase):
+    def dump(self, nodes):
+        return [(i.title, i.url, i.selected, i.leaf, i.sibling, i.ancestor,
+                 i.descendant, self.dump(i.children),) for i in nodes]
+
+    def test_readonly_output(self):
+        processor = registry.processor
+        cut_levels = {
+            'from_level': 0, 'to_level': 1, 'extra_inactive': 0,
+            'extra_active': 1, 'extra_active_mode': 0,
+            'show_invisible': False, 'show_inactive_branch': False,
+        }
+        for kwargs, mutating in (({}, False,),
+                                 ({'namespace': 'TestMenu',}, True,),
+                                 ({'cut_levels': cut_levels,}, True,),):
+            request, nodes = self.get_nodes('/j/b/', **kwargs)
+            menuconf = processor.menuconf(request)
+            self.assertEqual(processor.mutating(menuconf, None, kwargs),
+                             mutating)
+            readonly = processor.get_nodes(menuconf, request, readonly=True,
+                                           **kwargs)
+            self.assertEqual(
+                self.dump(readonly['state'].wrap(readonly['nodes'])),
+                self.dump(nodes['nodes']))
+
+
+class SharedTreesTestCase(MenusTestCase):
+    def setUp(self):
+        super(SharedTreesTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.set_settings(SHARED_TREES_DIR=self.path)
+        self.reset_processor()
+        self.expected = [self.get_nodes(i)[1]['selected'].title
+                         for i in ('/j/', '/j/b/', '/dynamic/item1/',)]
+
+    def test_lazy_branches(self):
+        filename = os.path.join(self.path, os.listdir(self.path)[0])
+        nodes = SharedTree.open(filename).load()
+        loader = nodes['index'].loader
+        self.assertEqual(loader.loaded, set([0, 2,]))  # leaf roots
+        self.assertEqual(nodes['paths']['j/b'].title, 'Public')
+        self.assertEqual(loader.loaded, set([0, 1, 2,]))
+
+    def test_layout(self):
+        filename = os.path.join(self.path, os.listdir(self.path)[0])
+        with open(filename, 'rb') as f:
+            data = f.read()
+        magic, count, vlength, hlength = struct.unpack_from('<8sIII', data)
+        offset = 20 + vlength + (-vlength % 4)
+        offsets = struct.unpack_from('<%dI' % (count + 1), data, offset)
+        tree = SharedTree.open(filename)
+        self.addCleanup(tree.close)
+        self.assertEqual(tree.offsets, offsets)
+        self.assertEqual(len(data), offset + 4 * (count + 1) + hlength +
+                         offsets[-1])
+
+    def test_threads(self):
+        self.reset_processor(clear=False)
+        results, paths = [], ('/j/', '/j/b/', '/dynamic/item1/',) * 20
+
+        def worker(items):
+            results.extend(self.get_nodes(i)[1]['selected'].title
+                           for i in items)
+        threads = [threading.Thread(target=worker, args=(paths[i::4],))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), sorted(self.expected * 20))
+
+
+class SelectionIndexTestCase(MenusTestCase):
+    def test_entry_per_path(self):
+        processor = registry.processor
+        self.get_nodes('/j/')  # nodes are built and cached
+        request = self.request('/j/b/')
+        processor.load_selection(request)
+        self.assertFalse(request.nodes.preloaded)
+        cache_key = processor.cache_key(request=request,
+                                        menuconf=processor.menuconf(request))
+        version = cache.get(processor.version_key(cache_key))
+        for path, saved in (('j/b', True,), ('j', False,),):
+            key = processor.selection_key(cache_key, version, 'anon', path)
+            self.assertEqual(cache.get(key, None) is not None, saved)
+
+        request = self.request('/j/b/')
+        processor.load_selection(request)
+        self.assertTrue(request.nodes.preloaded)
+        self.assertEqual(request.nodes.title, ['Jump', 'Public page',])
+        self.assertFalse(hasattr(request.nodes, 'menus'))
+
+        # selected node requires full nodes
+        for i in range(2):
+            request = self.request('/dynamic/item0/')
+            processor.load_selection(request)
+            self.assertFalse(request.nodes.preloaded)
+
+
+class StressTestCase(MenusTestCase):
+    settings = dict(MenusTestCase.settings, MENUS={
+        'default': {'MENUS': ['TestMenu',],},
+        'side': {'MENUS': ['SideMenu',], 'ROUTE': '^/side/',},
+    })
+
+    def test_menuconfs_threads(self):
+        result = stress(['/j/', '/j/b/', '/side/', '/dynamic/item1/',],
+                        threads=4, requests=400)
+        self.assertEqual(result['errors'], 0, result['failures'])
+
+    def test_menuconfs_selected(self):
+        # routed menuconf is selected, other one is processed in same request
+        result = process(registry.processor, '/side/', menuconfs=['default'])
+        self.assertEqual(result[None][:2], ('side', True,))
+        self.assertEqual(result['default'][:2], ('default', False,))
+
+
+class ExtenderTestCase(MenusTestCase):
+    settings = dict(MenusTestCase.settings, MENUS={
+        'default': {'MENUS': ['PatchMenu', 'SideMenu',],},
+    })
+
+    def setUp(self):
+        self.addCleanup(setattr, PatchMenu, 'items', PatchMenu.items)
+        PatchMenu.items = (
+            ('P', '/p/', 1, None, {'navigation_extenders': ['SideMenu',],},),
+            ('P1', '/p/1/', 2, 1, {},),
+            # own namespace extender does not attach its root (cycle)
+            ('Q', '/q/', 3, None, {'navigation_extenders': ['PatchMenu',
+                                                            'Unknown',],},),
+        )
+        super(ExtenderTestCase, self).setUp()
+
+    def test_extenders(self):
+        request, nodes = self.get_nodes('/side/')
+        self.assertEqual(
+            [(i.title, i.parent and i.parent.title, i.level,)
+             for i in tgenerator(nodes['nodes'])],
+            [('Q', None, 0,), ('P', 'Q', 1,), ('P1', 'P', 2,),
+             ('Side', 'P', 2,), ('Side public', 'Side', 3,),])
+        self.assertEqual(request.nodes.title, ['Q', 'P', 'Side',])
+
+
+class ReplayTestCase(MenusTestCase):
+    def test_replay(self):
+        import nodes.processor
+        fd, filename = tempfile.mkstemp()
+        self.addCleanup(os.remove, filename)
+        with os.fdopen(fd, 'w') as source:
+            source.write('# comment\n/j/ 0\n\n/j/a/ 1\n/s/ - en\n')
+
+        # current site is cached before threads (sqlite memory database)
+        Site.objects.get_current()
+        processor = registry.processor
+        result = replay(filename, threads=1, cache='locmem', repeat=3)
+        self.assertEqual((result['requests'], result['errors'],), (9, 0,))
+        # nodes are built once by each language (default and "en")
+        self.assertEqual(result['builds'], 2)
+        self.assertTrue(result['cache_hit_rate'] > 0)
+
+        # stand-in cache is set to processor only while replaying
+        self.assertIs(processor.cache, nodes.processor.cache)
+        self.assertIs(processor.cache, cache)
+        key = processor.version_key(processor.cache_key(
+            request=self.request('/j/'),
+            menuconf=processor.get_menuconf('default')))
+        self.assertEqual(cache.get(key), None)
+
+
+class TraceTestCase(MenusTestCase):
+    def process(self, path, touch=True):
+        request, response = self.request(path), HttpResponse()
+        response['Server-Timing'] = 'db;dur=1'
+        middleware = MenusTraceMiddleware()
+        middleware.process_request(request)
+        if touch:
+            for i in range(2):
+                registry.processor.get_nodes(None, request)
+        return middleware.process_response(request, response)
+
+    def test_server_timing(self):
+        timing = self.process('/j/b/')['Server-Timing'].split(', ')
+        self.assertEqual(timing[0], 'db;dur=1')
+        self.assertTrue(timing[1].startswith('menus-default;dur='))
+        self.assertTrue(timing[1].endswith(
+            ';desc="miss calls=2 rebuilds=0 copies=2"'))
+        self.assertIn('menus-default-build', [i.split(';')[0]
+                                              for i in timing])
+        self.assertIn('menus-default-AuthVisibility', [i.split(';')[0]
+                                                       for i in timing])
+
+        timing = self.process('/j/b/')['Server-Timing'].split(', ')
+        self.assertIn(';desc="hit calls=2', timing[1])
+        self.assertNotIn('menus-default-build', [i.split(';')[0]
+                                                 for i in timing])
+        # no menus processing - no metrics
+        self.assertEqual(self.process('/j/', False)['Server-Timing'],
+                         'db;dur=1')
+
+    def test_dump(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.set_settings(TRACE_DUMP=path)
+        self.process('/j/b/')
+        self.assertEqual(os.listdir(path), [])  # debug mode only
+
+        with override_settings(DEBUG=True):
+            self.process('/j/b/')
+            self.process('/j/', False)
+        names = os.listdir(path)
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names[0].endswith('-j_b.json'))
+        with open(os.path.join(path, names[0])) as f:
+            value = json.load(f)
+        self.assertEqual(value['path'], '/j/b/')
+        self.assertEqual(value['menus']['default']['cache'], 'hit')
+        self.assertEqual(value['menus']['default']['calls'], 2)
+
+
+class ViewsTestCase(MenusTestCase):
+    def test_json_etag(self):
+        response = menu_json(self.request('/j/'), 'default')
+        etag = response['ETag']
+        self.assertEqual(json.loads(b''.join(response.streaming_content))[0]
+                         ['title'], 'Home')
+        for header, status in (('"a", %s' % etag, 304,),
+                               ('W/%s' % etag, 304,),
+                               ('*', 304,),
+                               ('%s"' % etag[:-2], 200,),
+                               ('"x%s' % etag, 200,),):
+            request = self.request('/j/')
+            request.META['HTTP_IF_NONE_MATCH'] = header
+            self.assertEqual(menu_json(request, 'default').status_code,
+                             status, header)
+
+    def test_unknown_menuconf(self):
+        self.assertRaises(Http404, menu_json, self.request('/j/'), 'unknown')
+        self.assertRaises(Http404, menu_json, self.request('/j/'), 'default',
+                          'unknown')
+
+    def test_sitemap_pages(self):
+        response = sitemap(self.request('/'), 'default', limit=2)
+        self.assertIn(b'?p=3<', b''.join(response.streaming_content))
+        response = sitemap(self.request('/?p=2'), 'default', limit=2)
+        self.assertEqual(b''.join(response.streaming_content).count(b'<url>'),
+                         2)
+        self.assertRaises(Http404, sitemap, self.request('/?p=4'), 'default',
+                          limit=2)
+
+
+class RebuildTestCase(MenusTestCase):
+    def test_remember_language(self):
+        processor = registry.processor
+        menuconf = processor.get_menuconf('default')
+        key = processor.languages_key(menuconf)
+        cache.set('%s_lock' % key, True)
+        processor.remember_language(menuconf)
+        self.assertEqual(cache.get(key), None)  # lock is busy
+        cache.delete('%s_lock' % key)
+        processor.remember_language(menuconf)
+        self.assertEqual(cache.get(key), set([get_language(),]))
+
+    def test_rebuilds_not_overlapped(self):
+        class Processor(object):
+            active, calls, lock = [0], [], threading.Lock()
+
+            def rebuild(self, name):
+                with self.lock:
+                    self.active[0] += 1
+                    self.calls.append((name, self.active[0],))
+                time.sleep(0.05)
+                with self.lock:
+                    self.active[0] -= 1
+
+        processor = Processor()
+        rebuilder = Rebuilder(processor, 0.01)
+        rebuilder.schedule(['a',])
+        time.sleep(0.03)  # first rebuild is running
+        rebuilder.schedule(['b',])
+        for i in range(100):
+            if len(processor.calls) == 2 and not rebuilder.running:
+                break
+            time.sleep(0.01)
+        self.assertEqual(processor.calls, [('a', 1,), ('b', 1,),])
+
+    def rebuilder(self, delay):
+        class Processor(object):
+            calls = []
+
+            def rebuild(self, name):
+                self.calls.append((name, time.time(),))
+
+        return Rebuilder(Processor(), delay)
+
+    def wait(self, condition):
+        for i in range(200):
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_debounce(self):
+        # changes are coalesced into single rebuild after quiet delay
+        rebuilder = self.rebuilder(0.1)
+        calls = rebuilder.processor.calls
+        rebuilder.schedule(['b',])
+        time.sleep(0.05)
+        rebuilder.schedule(['a', 'b',])
+        last = time.time()
+        timer = rebuilder.timer
+        self.assertTrue(timer.daemon)
+        self.assertTrue(self.wait(lambda: len(calls) == 2))
+        self.assertEqual([i[0] for i in calls], ['a', 'b',])
+        self.assertTrue(calls[0][1] - last >= 0.09)
+
+        # timer thread ends after rebuild, no pending work is left
+        timer.join(1)
+        self.assertFalse(timer.is_alive())
+        self.assertTrue(self.wait(lambda: not rebuilder.running))
+        self.assertEqual((rebuilder.timer, rebuilder.pending,), (None, set(),))
+        time.sleep(0.15)
+        self.assertEqual(len(calls), 2)
+
+    def test_debounce_limit(self):
+        # continuous changes do not postpone rebuild forever
+        rebuilder = self.rebuilder(0.04)
+        rebuilder.max_delays = 3
+        calls, start = rebuilder.processor.calls, time.time()
+        while not calls and time.time() - start < 1:
+            rebuilder.schedule(['a',])
+            time.sleep(0.01)
+        self.assertTrue(calls)
+        self.assertTrue(calls[0][1] - start < 0.3)
+        self.assertTrue(self.wait(lambda: rebuilder.timer is None and
+                                  not rebuilder.running))
+
+
+class TagsTestCase(MenusTestCase):
+    def test_show_menu_fast_lazy(self):
+        # branches of not rendered children are not loaded
+        self.set_settings(BRANCH_STORAGE=True)
+        self.reset_processor()
+        self.get_nodes('/')
+        request = self.request('/')
+        output = show_menu_fast({'request': request,}, to_level=0)
+        self.assertEqual(output.count(u'<li'), 4)
+        self.assertIn(u'<li class="leaf"><a href="/s/">Secret</a>', output)
+        # jump url of Jump is resolved by its children (hidden Private)
+        loader = request.nodes.menus['default']['index'].loader
+        self.assertEqual(loader.loaded, set([0, 1, 2,]))
+
+    def test_show_menu_fast_type(self):
+        output = show_menu_fast({'request': self.request('/j/b/'),})
+        self.assertIsInstance(output, SafeText)
+        self.assertIn(u'Public', output)
+        # empty output (no request or no nodes) has the same type
+        for context, kwargs in (({}, {},),
+                                ({'request': self.request('/j/b/'),},
+                                 {'namespace': 'Unknown',},),):
+            output = show_menu_fast(context, **kwargs)
+            self.assertEqual(output, u'')
+            self.assertIsInstance(output, SafeText)
+
+
+class MarksTestCase(MenusTestCase):
+    paths = ('/', '/j/b/', '/s/a/', '/dynamic/item1/', '/none/',)
+    cut_levels = {
+        'from_level': 0, 'to_level': 1, 'extra_inactive': 0,
+        'extra_active': 100, 'extra_active_mode': 0,
+        'show_invisible': False, 'show_inactive_branch': False,
+    }
+    spec = [
+        {'item_start': u'<li class="{classes}" data-level="{level}">'
+                       u'<a href="{url}">{title}</a>',},
+        {'list_start': u'<ol>', 'list_end': u'</ol>',
+         'item_end': u'</li>\n',},
+    ]
+
+    def marks(self, nodes):
+        """Baseline marks (PositionalMarker full tree walk) by node id."""
+        marks = dict((i.id, {'leaf': not i.children,},)
+                     for i in tgenerator(nodes['nodes']))
+        selected = [i for i in tgenerator(nodes['nodes']) if i.selected]
+        if selected:
+            selected = selected[0]
+            for i in (selected.parent.children if selected.parent else
+                      nodes['nodes']):
+                marks[i.id]['sibling'] = i is not selected
+            ancestor = selected
+            while ancestor.parent:
+                ancestor = ancestor.parent
+                marks[ancestor.id]['ancestor'] = True
+            for i in tgenerator(selected.children):
+                marks[i.id]['descendant'] = True
+        names = ('selected', 'ancestor', 'sibling', 'descendant',)
+        for i in tgenerator(nodes['nodes']):
+            marks[i.id].update((name, marks[i.id].get(name, False) or
+                                (name == 'selected' and i.selected),)
+                               for name in names)
+        return marks
+
+    def test_marks(self):
+        for path in self.paths:
+            for user in (None, User(username='test'),):
+                marks = self.marks(self.get_nodes(path, user)[1])
+                for kwargs in ({}, {'cut_levels': self.cut_levels,},):
+                    request, nodes = self.get_nodes(path, user, **kwargs)
+                    for node in tgenerator(nodes['nodes']):
+                        self.assertEqual(
+                            dict((k, getattr(node, k),) for k in marks[
+                                node.id]), marks[node.id], (path, node.id,))
+
+    def html(self, nodes, level=0):
+        spec = [dict(render.DEFAULT_SPEC, **i) for i in self.spec]
+        current, output = spec[min(level, len(spec) - 1)], []
+        for node in nodes:
+            classes = u' '.join(i for i in ('selected', 'ancestor', 'sibling',
+                                            'descendant', 'leaf',)
+                                if getattr(node, i))
+            output.append(current['item_start'].format(
+                url=node.url, title=node.title, classes=classes,
+                level=level))
+            output.append(self.html(node.children, level + 1)
+                          if node.children else u'')
+            output.append(current['item_end'])
+        return current['list_start'] + u''.join(output) + current['list_end']
+
+    def test_render_spec(self):
+        # compiled renderer output is same as baseline get_nodes tree markup
+        self.set_settings(RENDER_SPECS={'marks': self.spec,})
+        self.addCleanup(render._compiled.pop, 'marks', None)
+        for path in self.paths:
+            for user in (None, User(username='test'),):
+                for kwargs in ({}, {'to_level': 1,},):
+                    request = self.request(path, user)
+                    output = show_menu_fast({'request': request,},
+                                            spec='marks', **kwargs)
+                    cut_levels = dict(self.cut_levels,
+                                      to_level=kwargs.get('to_level', 100))
+                    request, nodes = self.get_nodes(path, user,
+                                                    cut_levels=cut_levels)
+                    self.assertEqual(output, self.html(nodes['nodes']))
+
+
+class BranchesTestCase(MenusTestCase):
+    settings = dict(MenusTestCase.settings, MENUS={
+        'default': {'MENUS': ['PatchMenu',], 'LABELS': True,},
+    })
+    cut_levels = {
+        'from_level': 0, 'to_level': 100, 'extra_inactive': 0,
+        'extra_active': 100, 'extra_active_mode': 0,
+        'show_invisible': False, 'show_inactive_branch': False,
+    }
+
+    def setUp(self):
+        # roots r0..r3 with two children (and jump r1 and r2)
+        items, labels = [], {}
+        for i in range(4):
+            items.append(('R%d' % i, '/r%d/' % i, i + 1, None,
+                          {'jump': i in (1, 2,),},))
+            for j in range(2):
+                id = 10 * (i + 1) + j
+                items.append(('R%d.%d' % (i, j), '/r%d/%d/' % (i, j), id,
+                              i + 1, {},))
+                labels[id] = {'title': 'D%d.%d' % (i, j),
+                              'url': '/de/r%d/%d/' % (i, j),}
+        labels[2] = {'title': 'D1', 'url': '/de/r1/',}
+        self.addCleanup(setattr, PatchMenu, 'items', PatchMenu.items)
+        self.addCleanup(setattr, PatchMenu, 'labels', PatchMenu.labels)
+        PatchMenu.items, PatchMenu.labels = items, labels
+        super(BranchesTestCase, self).setUp()
+        self.set_settings(BRANCH_STORAGE=True)
+        self.reset_processor()
+
+    def loaded(self, path, lang):
+        # show_menu like (readonly) nodes of active branch only
+        with override(lang):
+            self.get_nodes(path)  # cached nodes
+            request, nodes = self.get_nodes(path, readonly=True,
+                                            cut_levels=self.cut_levels)
+            titles = [(i.title, i.url, i.parent and i.parent.title,)
+                      for i in tgenerator(nodes['nodes'])]
+            return nodes['index'].loader.loaded, titles
+
+    def test_active_branch(self):
+        loaded, titles = self.loaded('/r2/1/', 'en-us')
+        self.assertEqual(loaded, set([2,]))
+        self.assertEqual(titles, [
+            ('R0', '/r0/', None,), ('R1', '/r1/0/', None,),
+            ('R2', '/r2/0/', None,), ('R2.0', '/r2/0/', 'R2',),
+            ('R2.1', '/r2/1/', 'R2',), ('R3', '/r3/', None,),])
+
+    def test_labels(self):
+        # label table is applied to branches on loading
+        loaded, titles = self.loaded('/de/r2/1/', 'de')
+        self.assertEqual(loaded, set([2,]))
+        self.assertEqual(titles, [
+            ('R0', '/r0/', None,), ('D1', '/de/r1/0/', None,),
+            ('R2', '/de/r2/0/', None,), ('D2.0', '/de/r2/0/', 'R2',),
+            ('D2.1', '/de/r2/1/', 'R2',), ('R3', '/r3/', None,),])
+
+        # same labelled nodes as full tree labelling (no branch storage)
+        self.set_settings(BRANCH_STORAGE=False)
+        self.reset_processor()
+        with override('de'):
+            request, nodes = self.get_nodes('/de/r2/1/',
+                                            cut_levels=self.cut_levels)
+        self.assertEqual([(i.title, i.url, i.parent and i.parent.title,)
+                          for i in tgenerator(nodes['nodes'])], titles)
+
+
+class LookupTestCase(MenusTestCase):
+    settings = dict(MenusTestCase.settings, MENUS={
+        'default': {'MENUS': ['TestMenu', 'SideMenu', 'PatchMenu',],},
+    })
+
+    def setUp(self):
+        self.addCleanup(setattr, PatchMenu, 'items', PatchMenu.items)
+        PatchMenu.items = (
+            ('P', '/p/', 1, None, {'reverse_id': 'p',},),
+            ('P2', '/p/2/', 2, 1, {'reverse_id': 'p2',
+                                   'auth_required': True,},),
+        )
+        super(LookupTestCase, self).setUp()
+
+    def get_node(self, user=None, **kwargs):
+        node = registry.processor.get_node(self.request('/', user), **kwargs)
+        return node and (node.title, node.url,)
+
+    def test_get_node(self):
+        user = User(username='test')
+        self.assertEqual(self.get_node(id=1), ('Home', '/',))
+        self.assertEqual(self.get_node(id=1, namespace='SideMenu'),
+                         ('Side', '/side/',))
+        self.assertEqual(self.get_node(id=1, namespace='PatchMenu'),
+                         ('P', '/p/',))
+        self.assertEqual(self.get_node(id=100), None)
+        self.assertEqual(self.get_node(reverse_id='p'), ('P', '/p/',))
+        self.assertEqual(self.get_node(url='/side/?a=1'), ('Side', '/side/',))
+        self.assertEqual(self.get_node(url='/'), ('Home', '/',))
+
+        # hidden nodes are not found, jump urls are state ones
+        self.assertEqual(self.get_node(reverse_id='p2'), None)
+        self.assertEqual(self.get_node(user, reverse_id='p2'),
+                         ('P2', '/p/2/',))
+        self.assertEqual(self.get_node(id=3), None)
+        self.assertEqual(self.get_node(url='/s/a/'), None)
+        self.assertEqual(self.get_node(id=2), ('Jump', '/j/b/',))
+        self.assertEqual(self.get_node(user, id=2), ('Jump', '/j/a/',))
+
+        context = {'request': self.request('/'),}
+        self.assertEqual(node_url(context, reverse_id='p'), '/p/')
+        self.assertEqual(node_url(context, reverse_id='none'), '')
+
+    def test_get_node_selected(self):
+        # url lookup gives same node as get_nodes selection
+        for path in ('/j/', '/j/b/', '/side/', '/p/', '/dynamic/',):
+            request, nodes = self.get_nodes(path)
+            node = registry.processor.get_node(request, url=path)
+            self.assertEqual((node.id, node.namespace,),
+                             (nodes['selected'].id,
+                              nodes['selected'].namespace,))
+
+
+class JumpTestCase(MenusTestCase):
+    settings = dict(MenusTestCase.settings, MENUS={
+        'default': {'MENUS': ['PatchMenu',],},
+    })
+    jump, auth = {'jump': True,}, {'auth_required': True,}
+    items = [
+        ('A', '/a/', 1, None, jump,),
+        ('B', '/a/b/', 2, 1, dict(jump, **auth),),
+        ('X', '/a/b/x/', 3, 2, {},),
+        ('Y', '/a/y/', 4, 1, {},),
+        ('C', '/c/', 5, None, jump,),
+        ('K', '/c/k/', 6, 5, auth,),
+        ('D', '/d/', 7, None, jump,),
+        ('E', '/d/e/', 8, 7, jump,),
+        ('F', '/d/e/f/', 9, 8, jump,),
+        ('Z', '/d/e/f/z/', 10, 9, auth,),
+        ('W', '/d/e/w/', 11, 8, {},),
+        ('G', '/g/', 12, None, jump,),
+        ('H', '/g/h/', 13, 12, {},),
+    ]
+
+    def setUp(self):
+        self.addCleanup(setattr, PatchMenu, 'items', PatchMenu.items)
+        PatchMenu.items = self.items
+        super(JumpTestCase, self).setUp()
+
+    def resolve(self, node):
+        """
+        Baseline (full tree walk) url: jump gets url of its first visible
+        child (recursive), jump without visible children keeps url resolved
+        by full tree (ONCE).
+        """
+        while node.data.get('jump', False) and node.children:
+            node = node.children[0]
+        items, id = dict((i[2], i,) for i in self.items), node.id
+        children = [i for i in self.items if i[3] == id]
+        while items[id][4].get('jump', False) and children:
+            id = children[0][2]
+            children = [i for i in self.items if i[3] == id]
+        return items[id][1]
+
+    def test_urls(self):
+        expected = {
+            None: {1: '/a/y/', 5: '/c/k/', 7: '/d/e/f/z/', 8: '/d/e/f/z/',
+                   9: '/d/e/f/z/', 12: '/g/h/',},
+            'test': {1: '/a/b/x/', 2: '/a/b/x/', 5: '/c/k/', 7: '/d/e/f/z/',
+                     8: '/d/e/f/z/', 9: '/d/e/f/z/', 12: '/g/h/',},
+        }
+        for storage in (False, True,):
+            self.set_settings(BRANCH_STORAGE=storage)
+            self.reset_processor()
+            for user in (None, User(username='test'),):
+                for path in ('/', '/d/e/w/', '/a/b/x/',):
+                    request, nodes = self.get_nodes(path, user)
+                    urls = dict((i.id, i.url,)
+                                for i in tgenerator(nodes['nodes']))
+                    self.assertEqual(urls, dict(
+                        (i.id, self.resolve(i),)
+                        for i in tgenerator(nodes['nodes'])))
+                    self.assertEqual(
+                        dict((k, v,) for k, v in urls.items()
+                             if PatchMenu.items[k - 1][4].get('jump')),
+                        expected[user and user.username])
+
+
+class PatchTestCase(MenusTestCase):
+    settings = dict(MenusTestCase.settings, MENUS={
+        'default': {'MENUS': ['PatchMenu',],},
+    })
+    items = [
+        ('Home', '/', 1, None, {},),
+        ('J1', '/j1/', 2, None, {'jump': True,},),
+        ('J2', '/j2/', 3, 2, {'jump': True,},),
+        ('C', '/c/', 4, 3, {},),
+        ('D', '/d/', 5, 1, {},),
+        ('D2', '/d/', 6, None, {},),
+        ('E', '/e/', 7, None, {},),
+    ]
+
+    def setUp(self):
+        self.addCleanup(setattr, PatchMenu, 'items', PatchMenu.items)
+        PatchMenu.items = self.items
+        super(PatchTestCase, self).setUp()
+
+    def dump(self, nodes):
+        return ([(i.id, i.parent and i.parent.id, i.index, i.title, i.url,
+                  i.url_original, i.level, i.level_original,)
+                 for i in tgenerator(nodes['nodes'])],
+                sorted((k, v.id,) for k, v in nodes['paths'].items()),
+                sorted(nodes.get('jumps', {}).items()),)
+
+    def check(self, ops, items):
+        """Compare patched nodes with full rebuild of changed items."""
+        PatchMenu.items = self.items
+        processor = self.reset_processor()
+        self.get_nodes('/')
+        patched = self.dump(processor.patch('default', ops))
+
+        PatchMenu.items = items
+        request = processor.rebuild_request()
+        menuconf = processor.get_menuconf('default')
+        rebuilt = processor.create_nodes(
+            menuconf, request, processor.cache_key(request=request,
+                                                   menuconf=menuconf))
+        self.assertEqual(patched, self.dump(rebuilt))
+        return dict((i[0], i,) for i in patched[0])
+
+    def key(self, id):
+        return id and ('PatchMenu', id,)
+
+    def items_without(self, *ids):
+        return [i for i in self.items if i[2] not in ids]
+
+    def test_update(self):
+        items = self.items_without(4)
+        items[1] = ('J1x',) + items[1][1:]
+        patched = self.check([('update', self.key(2), {'title': 'J1x',},),
+                              ('remove', self.key(4),),], items)
+        self.assertEqual([patched[i][4] for i in (2, 3,)], ['/j2/', '/j2/',])
+
+        items = list(self.items)
+        items[5] = ('D2', '/x/', 6, None, {},)
+        self.check([('update', self.key(6), {'url': '/x/',},),], items)
+
+    def test_add(self):
+        items = list(self.items)
+        items.insert(3, ('F', '/f/', 8, 3, {},))
+        patched = self.check(
+            [('add', self.key(3), NavigationNode('F', '/f/', 8), 0,)], items)
+        self.assertEqual(patched[2][4], '/f/')
+
+        items = self.items + [('D3', '/d/', 9, 7, {},)]
+        self.check([('add', self.key(7), NavigationNode('D3', '/d/', 9),)],
+                   items)
+
+    def test_move(self):
+        # move D after its path rival D2
+        items = self.items_without(5) + [('D', '/d/', 5, 7, {},)]
+        self.check([('move', self.key(5), self.key(7),)], items)
+
+        items = self.items_without(4) + [('C', '/c/', 4, None, {},)]
+        patched = self.check([('move', self.key(4), None,)], items)
+        self.assertEqual(patched[2][4], '/j2/')
+
+    def test_remove(self):
+        self.check([('remove', self.key(6),)], self.items_without(6))
+        self.check([('remove', self.key(2),)], self.items_without(2, 3, 4))
+
+
+class PayloadTestCase(MenusTestCase):
+    def test_not_saved(self):
+        processor = registry.processor
+        limited = processor.cache = LimitedCache('limited', {})
+        menuconf = processor.get_menuconf('default')
+        self.assertEqual(processor.cache_set_many(menuconf, {
+            'small': 1, 'large': 'x' * 1000,}, 60), ['large',])
+
+        # chunks are checked too
+        self.set_settings(CHUNK_SIZE=200)
+        self.assertEqual(processor.cache_set_many(menuconf, {
+            'large': 'x' * 1000,}, 60), [])
+        limited.limit = 100
+        self.assertEqual(processor.cache_set_many(menuconf, {
+            'other': 'x' * 1000,}, 60), ['other_chunk%d' % i
+                                         for i in range(5)])
+
+        # nodes version is not changed
+        request, nodes = self.get_nodes('/j/')
+        cache_key = processor.cache_key(request=request, menuconf=menuconf)
+        self.assertEqual(limited.get(processor.version_key(cache_key)), None)
+
+
+class LazyDataTestCase(MenusTestCase):
+    settings = dict(MenusTestCase.settings, MENUS={
+        'default': {'MENUS': ['PatchMenu',],},
+    }, TREE_DATA_KEYS=('jump', 'auth_required',))
+
+    def setUp(self):
+        self.addCleanup(setattr, PatchMenu, 'items', PatchMenu.items)
+        PatchMenu.items = [('Item %d' % i, '/i%d/' % i, i, None,
+                            {'icon': 'i%d' % i,},) for i in range(1, 6)]
+        PatchMenu.items += [('Child', '/i1/c/', 6, 1, {'icon': 'c',},)]
+        super(LazyDataTestCase, self).setUp()
+
+    def test_grouped_loading(self):
+        processor = registry.processor
+        calls = []
+        cache_get_many = processor.cache_get_many
+        processor.cache_get_many = lambda keys: (calls.append(keys) or
+                                                 cache_get_many(keys))
+        self.get_nodes('/i1/')
+        request, nodes = self.get_nodes('/i2/')
+        del calls[:]
+        icons = [i.data['icon'] for i in tgenerator(nodes['nodes'])]
+        self.assertEqual(icons, ['i1', 'c', 'i2', 'i3', 'i4', 'i5',])
+        self.assertEqual(len(calls), 1)
+
+
+class MaskEngineTestCase(MenusTestCase):
+    settings = dict(MenusTestCase.settings, MENUS={
+        'default': {'MENUS': ['PatchMenu', 'TestMenu',],},
+    })
+
+    def setUp(self):
+        # three levels tree with invisible and auth required nodes
+        items, id = [], 100
+        for i in range(3):
+            items.append(('R%d' % i, '/r%d/' % i, i + 1, None, {},))
+            for j in range(3):
+                id += 1
+                items.append(('R%d.%d' % (i, j), '/r%d/%d/' % (i, j), id,
+                              i + 1, {'auth_required': j == 1,}, j != 2,))
+                for k in range(2):
+                    items.append(('R%d.%d.%d' % (i, j, k),
+                                  '/r%d/%d/%d/' % (i, j, k), id * 10 + k, id,
+                                  {},))
+        self.addCleanup(setattr, PatchMenu, 'items', PatchMenu.items)
+        PatchMenu.items = items
+        super(MaskEngineTestCase, self).setUp()
+
+    def dump(self, nodes):
+        return [(i.title, i.url, i.parent and i.parent.id,
+                 [j.id for j in i.children],)
+                for i in tgenerator(nodes['nodes'])]
+
+    def results(self, engine):
+        self.set_settings(MASK_ENGINE=engine)
+        self.reset_processor()
+        results = []
+        for path in ('/', '/r1/', '/r1/0/', '/r2/0/1/', '/j/b/',):
+            for user in (None, User(username='test'),):
+                for from_level, to_level, extra_inactive, extra_active in (
+                        (0, 100, 100, 100,), (0, 1, 0, 100,),
+                        (1, 2, 0, 1,), (1, 100, 1, 100,), (2, 2, 0, 0,),):
+                    for show_invisible in (False, True,):
+                        cut_levels = {
+                            'from_level': from_level, 'to_level': to_level,
+                            'extra_inactive': extra_inactive,
+                            'extra_active': extra_active,
+                            'extra_active_mode': 0,
+                            'show_invisible': show_invisible,
+                            'show_inactive_branch': False,
+                        }
+                        results.append(self.dump(self.get_nodes(
+                            path, user, cut_levels=cut_levels)[1]))
+                results.append(self.dump(self.get_nodes(
+                    path, user, namespace='PatchMenu')[1]))
+        return results
+
+    def test_results(self):
+        from .utils.arrays import numpy
+        if numpy is None:
+            self.skipTest('NumPy is not installed.')
+        from .utils import arrays
+        calls, cut_levels = [], arrays.TreeArrays.cut_levels
+        self.addCleanup(setattr, arrays.TreeArrays, 'cut_levels', cut_levels)
+        arrays.TreeArrays.cut_levels = lambda *a: (calls.append(1),
+                                                   cut_levels(*a),)[1]
+        results = self.results(True)
+        self.assertTrue(calls)
+        self.assertEqual(results, self.results(False))
+        self.assertTrue(len(set(map(repr, results))) > 10)
@@ -43,6 +43,17 @@ def tgenerator(nodes):
                                                             i6.children):
                                                         yield deeper
 
+def tskipper(nodes, skipped):
+    """Unwrap hierarchical nodes struct, skip subtrees by index values."""
+    stack = nodes[::-1]
+    while stack:
+        node = stack.pop()
+        if node.index in skipped:
+            continue
+        yield node
+        if node.children and not node.index in skipped:
+            stack.extend(node.children[::-1])
+
 def tcutter(nodes, function):
     """Cut tree by function."""
     for i in nodes[:]:
@@ -0,0 +1,151 @@
+"""
+Optional vectorized engine for tree filtering modifiers.
+
+Nodes tree is stored as flat arrays in pre-order (node.index) sequence:
+parent index, level, last descendant index (pre-order interval), namespace
+codes and visibility flags. Filters compute keep-masks with NumPy boolean
+operations and then rewire only survived nodes. If NumPy is not installed
+engine is disabled and modifiers use pure python tree handling.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ..base import DEFAULT
+
+
+class TreeArrays(object):
+    """Flat arrays representation of indexed (ONCE) nodes tree."""
+
+    def __init__(self, index):
+        size = len(index)
+        namespaces, codes = {}, []
+        parent, last = [-1] * size, list(range(size))
+
+        for node in index:
+            codes.append(namespaces.setdefault(node.namespace,
+                                               len(namespaces)))
+            if node.parent is not None:
+                parent[node.index] = node.parent.index
+
+        # pre-order: last descendant of node is the last of its last child
+        for node in reversed(index):
+            if node.children:
+                last[node.index] = last[node.children[-1].index]
+
+        self.size = size
+        self.namespaces = namespaces
+        self.parent = numpy.array(parent, dtype=numpy.int32)
+        self.last = numpy.array(last, dtype=numpy.int32)
+        self.namespace = numpy.array(codes, dtype=numpy.int32)
+        self.visible = numpy.array([i.visible for i in index], dtype=bool)
+
+        level = numpy.zeros(size, dtype=numpy.int32)
+        for node in index:
+            if node.parent is not None:
+                level[node.index] = level[node.parent.index] + 1
+        self.level = level
+
+    def __deepcopy__(self, memo):
+        return self  # immutable, no copy required
+
+    # masks
+    def subtrees(self, indexes):
+        """Mask of nodes inside subtrees of nodes with indexes."""
+        indexes = numpy.fromiter(indexes, dtype=numpy.int32)
+        diff = numpy.zeros(self.size + 1, dtype=numpy.int32)
+        numpy.add.at(diff, indexes, 1)
+        numpy.add.at(diff, self.last[indexes] + 1, -1)
+        return numpy.cumsum(diff[:-1]) > 0
+
+    def members(self, nodes, hidden):
+        """Mask of nodes in current tree (with roots nodes) except hidden."""
+        mask = self.subtrees(i.index for i in nodes)
+        if hidden:
+            mask &= ~self.subtrees(hidden)
+        return mask
+
+    # materialization
+    def materialize(self, index, keep, nodes):
+        """
+        Rewire kept nodes into new forest, works like utils.tfilter:
+        kept nodes without kept parent become new roots (after kept
+        current roots). Return list of roots.
+        """
+        orphans = keep & ~numpy.append(keep, False)[self.parent]
+        kept, keep = numpy.flatnonzero(keep).tolist(), keep.tolist()
+
+        roots = [i for i in nodes if keep[i.index]]
+        current = set(i.index for i in roots)
+        for i in numpy.flatnonzero(orphans).tolist():
+            node = index[i]
+            node.parent = None
+            i in current or roots.append(node)
+        for i in kept:
+            node = index[i]
+            if node.children:
+                node.children = [c for c in node.children if keep[c.index]]
+        return roots
+
+    # filters
+    def filter_namespace(self, index, nodes, namespace, hidden):
+        """Filter current tree by namespace, return (roots, removed?)."""
+        members = self.members(nodes, hidden)
+        code = self.namespaces.get(namespace, -1)
+        keep = members & (self.namespace == code)
+        return (self.materialize(index, keep, nodes),
+                bool((members != keep).any()),)
+
+    def cut_levels(self, index, batch, from_level, show_invisible, hidden):
+        """
+        Cut roots subtrees in range from_level..to_level (by CutLevels
+        cut_before_and_after rules). Batch is list of (root, to_level, items)
+        values, items list is filled by nodes on from_level of each root.
+        """
+        base = numpy.zeros(self.size, dtype=numpy.int32)
+        limit = numpy.full(self.size, -1, dtype=numpy.int32)
+        owner = numpy.full(self.size, -1, dtype=numpy.int32)
+        for position, (root, to_level, items) in enumerate(batch):
+            start, stop = root.index, self.last[root.index] + 1
+            base[start:stop] = self.level[root.index]
+            limit[start:stop] = max(to_level, from_level)
+            owner[start:stop] = position
+
+        level = self.level - base
+        keep = (level >= from_level) & (level <= limit)
+        if hidden:
+            keep &= ~self.subtrees(hidden)
+
+        # invisible nodes allowed only on two first levels if required
+        keep &= (self.visible | (level < from_level + 2) if show_invisible
+                 else self.visible)
+
+        # rewire survived nodes and fill roots items lists: kept node under
+        # not kept parent is never reached from items, so no per-level pass
+        # to propagate parents keep values is required
+        kept = numpy.flatnonzero(keep).tolist()
+        level, limit, keep = level.tolist(), limit.tolist(), keep.tolist()
+        for i in kept:
+            node = index[i]
+            if level[i] == limit[i]:
+                node.children = []
+            elif node.children:
+                node.children = [c for c in node.children if keep[c.index]]
+            if level[i] == from_level:
+                from_level and setattr(node, 'parent', None)
+                batch[owner[i]][2].append(node)
+
+
+def get_tree_arrays(data, meta):
+    """
+    Get TreeArrays of nodes data if engine is applicable: arrays are built
+    and nodes structure is not modified by previous DEFAULT modifiers
+    (except hidden by state and root nodes changes).
+    """
+    arrays = data.get('arrays', None)
+    if arrays is None or numpy is None or meta['rebuild_mode']:
+        return None
+    if DEFAULT == meta['modify_event'] and meta['modified_descendants']:
+        return None
+    return arrays
@@ -0,0 +1,322 @@
+"""
+Partial nodes loading by top-level branches.
+
+Indexed (ONCE) nodes data is stored as head cache entry (root nodes and
+nodes data without "nodes" and "index" values) and separate entry with
+children subtree of each root node (branch). Nodes in head and in branches
+referenced from outside are stored as persistent ids (indexes).
+
+Loaded head gives lazy nodes data: roots have lazy children lists, index
+and paths resolve nodes by indexes, so branch is fetched from cache only
+when any code walks into it (few branches are fetched by single get_many).
+Branches loading is locked, so lazy nodes data can be shared by threads
+(see utils.shared).
+"""
+import bisect
+import copy
+import threading
+from collections import MutableMapping
+from io import BytesIO
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from . import tgenerator, tcutter
+
+
+def _dumps(value, persistent_id):
+    stream = BytesIO()
+    pickler = pickle.Pickler(stream, 2)
+    pickler.persistent_id = persistent_id
+    pickler.dump(value)
+    return stream.getvalue()
+
+
+def _loads(value, persistent_load):
+    unpickler = pickle.Unpickler(BytesIO(value))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
+def split_nodes(data):
+    """Split indexed nodes data into head value and branches values list."""
+    index, roots = data['index'], data['nodes']
+    ids = dict((id(node), node.index) for node in index)
+    starts = [i.index for i in roots]
+    lasts = [i - 1 for i in starts[1:]] + [len(index) - 1]
+
+    def outer(start, last):
+        # nodes out of (start, last] range are stored as persistent ids
+        def persistent_id(obj):
+            i = ids.get(id(obj), None)
+            return None if i is None or start < i <= last else 'n%d' % i
+        return persistent_id
+
+    records = []
+    for root in roots:
+        attrs = dict(root.__dict__)
+        attrs.pop('parent', None)
+        attrs.pop('children', None)
+        records.append(attrs)
+
+    extra = dict((k, v) for k, v in data.items()
+                 if k not in ('nodes', 'index',))
+    if 'paths' in extra:
+        extra['paths'] = dict((k, v.index) for k, v in extra['paths'].items())
+
+    head = {
+        'size': len(index), 'starts': starts,
+        'classes': [i.__class__ for i in roots],
+        'counts': [len(i.children) for i in roots],
+        'indexes': [[j.index for j in i.children] for i in roots],
+        'records': _dumps(records, outer(-1, -1)),
+        'extra': _dumps(extra, outer(-1, -1)),
+    }
+    branches = [_dumps(list(root.children), outer(start, last))
+                for root, start, last in zip(roots, starts, lasts)]
+    return head, branches
+
+
+def load_nodes(head, fetch):
+    """
+    Get lazy nodes data by head value, fetch(positions) should return
+    branches values list of roots positions.
+    """
+    loader = BranchLoader(head, fetch)
+    data = _loads(head['extra'], loader.persistent_load)
+    if 'paths' in data:
+        data['paths'] = IndexedPaths(loader, data['paths'])
+    data.update(nodes=list(loader.roots), index=LazyIndex(loader))
+    return data
+
+
+class BranchLoader(object):
+    """Lazy loader of stored nodes branches (and index of loaded nodes)."""
+
+    def __init__(self, head, fetch):
+        self.fetch = fetch
+        self.starts, self.counts = head['starts'], head['counts']
+        self.indexes = head.get('indexes', None)
+        self.index = [None] * head['size']
+        self.loaded = set(p for p, c in enumerate(self.counts) if not c)
+        self.hidden = self.filled = self.prepare = None
+        self.source = self.memo = None
+        self.lock = threading.RLock()
+
+        self.roots, self.children = [], {}
+        for i, cls in zip(self.starts, head['classes']):
+            self.index[i] = cls.__new__(cls)
+            self.roots.append(self.index[i])
+        records = _loads(head['records'], self.persistent_load)
+        for position, (node, attrs) in enumerate(zip(self.roots, records)):
+            node.__dict__.update(attrs, parent=None,
+                                 children=self.lazy_children(position))
+
+    def __deepcopy__(self, memo):
+        # copy of lazy nodes data: branches are loaded from source loader
+        # and copied with same memo (so parents are copied roots)
+        clone = memo[id(self)] = BranchLoader.__new__(BranchLoader)
+        clone.source, clone.memo = self, memo
+        clone.starts, clone.counts = self.starts, self.counts
+        clone.indexes = self.indexes
+        clone.index = [None] * len(self.index)
+        clone.loaded, clone.hidden, clone.filled = set(self.loaded), None, None
+        clone.prepare = None  # nodes of source are already prepared
+        clone.roots, clone.children = None, {}
+        clone.lock = threading.RLock()
+        return clone
+
+    def lazy_children(self, position):
+        children = self.children.get(position, None)
+        if children is None:
+            children = self.children[position] = LazyChildren(
+                self, position, self.counts[position])
+        return children
+
+    def persistent_load(self, pid):
+        return self.get(int(pid[1:]))
+
+    def position(self, i):
+        return bisect.bisect_right(self.starts, i) - 1
+
+    def get(self, i):
+        node = self.index[i]
+        if node is None and self.source:
+            source = id(self.source.get(i))
+            if source not in self.memo:
+                self.load([self.position(i)])
+            node = self.index[i] = self.memo.get(source, None)
+        elif node is None:
+            self.load([self.position(i)])
+            node = self.index[i]
+        return node
+
+    def load(self, positions=None):
+        """Load branches by roots positions (all not loaded by default)."""
+        with self.lock:
+            self._load(positions)
+
+    def _load(self, positions):
+        positions = [p for p in (range(len(self.starts)) if positions is None
+                                 else sorted(set(positions)))
+                     if p not in self.loaded]
+        if not positions:
+            return
+        self.loaded.update(positions)
+
+        if self.source:
+            self.source.load(positions)
+            values = [[copy.deepcopy(i, self.memo)
+                       for i in self.source.children[p]] for p in positions]
+        else:
+            values = [_loads(i, self.persistent_load)
+                      for i in self.fetch(positions)]
+
+        for position, children in zip(positions, values):
+            self.prepare and self.prepare(position, children)
+            for node in tgenerator(children):
+                self.index[node.index] = node
+            hidden = self.hidden
+            if hidden:
+                tcutter(children, lambda i: i.index not in hidden)
+            self.lazy_children(position).fill(children)
+            self.filled and self.filled(position, children)
+
+    def exclude(self, roots, hidden):
+        """
+        Remove hidden (by indexes) nodes from roots list and loaded branches,
+        not loaded branches are cut on loading.
+        """
+        self.hidden = hidden
+        roots[:] = [i for i in roots if i.index not in hidden]
+        for i in hidden:
+            if i >= len(self.index) or self.position(i) not in self.loaded:
+                continue
+            parent = self.get(i).parent
+            if parent is not None and self.get(i) in parent.children:
+                parent.children.remove(self.get(i))
+
+
+class LazyChildren(list):
+    """Root children list, its branch is loaded on first access."""
+
+    def __init__(self, loader, position, count):
+        list.__init__(self)
+        self.loader, self.position, self.count = loader, position, count
+        self.loaded = not count
+
+    def fill(self, children):
+        list.extend(self, children)
+        self.loaded = True
+
+    def load(self):
+        self.loaded or self.loader.load([self.position])
+
+    def visible(self, hidden):
+        """Check that any child is not hidden (without branch loading)."""
+        indexes = self.loader.indexes
+        if self.loaded or indexes is None:
+            return any(i.index not in hidden for i in self)
+        return any(i not in hidden for i in indexes[self.position])
+
+    def __nonzero__(self):
+        return bool(len(self)) if self.loaded else bool(self.count)
+    __bool__ = __nonzero__
+
+    def __reduce__(self):
+        self.load()
+        return (list, (list(self),))
+
+    def __deepcopy__(self, memo):
+        if self.loaded:
+            return [copy.deepcopy(i, memo) for i in self]
+        return copy.deepcopy(self.loader, memo).lazy_children(self.position)
+
+
+def _loading(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args):
+        self.load()
+        return method(self, *args)
+    wrapper.__name__ = name
+    return wrapper
+
+for name in ('__iter__', '__len__', '__getitem__', '__getslice__',
+             '__contains__', '__reversed__', '__add__', '__mul__', '__eq__',
+             '__ne__', '__lt__', '__le__', '__gt__', '__ge__', '__repr__',
+             '__setitem__', '__delitem__', '__setslice__', '__delslice__',
+             '__iadd__', '__imul__', 'append', 'extend', 'insert', 'remove',
+             'pop', 'index', 'count', 'sort', 'reverse',):
+    if hasattr(list, name):
+        setattr(LazyChildren, name, _loading(name))
+
+
+class LazyIndex(object):
+    """Nodes index (pre-order list) with nodes loaded by branches."""
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __len__(self):
+        return len(self.loader.index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.loader.get(j) for j in xrange(*i.indices(len(self)))]
+        return self.loader.get(i if i >= 0 else i + len(self))
+
+    def __iter__(self):
+        self.loader.load()
+        return (self.loader.get(i) for i in xrange(len(self)))
+
+    def append(self, node):
+        self.loader.load()
+        self.loader.index.append(node)
+
+    def __deepcopy__(self, memo):
+        return LazyIndex(copy.deepcopy(self.loader, memo))
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+class IndexedPaths(MutableMapping):
+    """Paths dict with values stored as nodes indexes."""
+
+    def __init__(self, loader, paths):
+        self.loader, self.paths = loader, paths
+
+    def __getitem__(self, key):
+        value = self.paths[key]
+        return self.loader.get(value) if isinstance(value, int) else value
+
+    def __setitem__(self, key, value):
+        self.paths[key] = value
+
+    def __delitem__(self, key):
+        del self.paths[key]
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def items(self):
+        self.loader.load()
+        return [(k, self[k]) for k in self.paths]
+
+    def values(self):
+        return [v for k, v in self.items()]
+
+    def position(self, key):
+        """Root position of path node (None if path is not found)."""
+        value = self.paths.get(key, None)
+        if value is None:
+            return None
+        return self.loader.position(value if isinstance(value, int) else
+                                    value.index)
+
+    def __reduce__(self):
+        return (dict, (self.items(),))
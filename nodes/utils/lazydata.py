@@ -0,0 +1,86 @@
+"""
+Lazy node data: cached nodes tree keeps only node.data values required by
+modifiers (tree keys, see TREE_DATA_KEYS setting), other values of each
+node are stored as separate cache entry and fetched on first access.
+
+Values of tree keys are read without fetching, loader (Processor.load_data)
+fetches values of any lazy data items list by single get_many, e.g. of
+selected chain before metadata processing. Lazy data of nodes returned by
+get_nodes is grouped (see Processor.apply_state): first access to any
+item of group loads all of them by single get_many.
+"""
+
+
+class LazyData(dict):
+    """Node data with tree keys values, other values are loaded on access."""
+    __slots__ = ('source', 'index', 'tree_keys', 'lazy', 'group',)
+
+    def __init__(self, values=(), source=None, index=None, keys=(),
+                 lazy=False):
+        dict.__init__(self, values)
+        # source is (menuconf name, cache key, version) tuple
+        self.source, self.index = source, index
+        self.tree_keys, self.lazy = keys, lazy
+        self.group = None
+
+    def load(self):
+        if self.lazy:
+            from .. import registry
+            registry.processor.load_data(self.group or [self])
+        return self
+
+    def fill(self, values):
+        # values set after loading (e.g. labels) are not replaced
+        for key, value in values.items():
+            if not dict.__contains__(self, key):
+                dict.__setitem__(self, key, value)
+        self.lazy = False
+
+    def stored(self, key):
+        """Check that key value is available without loading."""
+        return (not self.lazy or key in self.tree_keys or
+                dict.__contains__(self, key))
+
+    def __getitem__(self, key):
+        self.stored(key) or self.load()
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        self.stored(key) or self.load()
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        self.stored(key) or self.load()
+        return dict.__contains__(self, key)
+
+    def has_key(self, key):
+        return self.__contains__(key)
+
+    def setdefault(self, key, default=None):
+        self.stored(key) or self.load()
+        return dict.setdefault(self, key, default)
+
+    def copy(self):
+        return LazyData(dict(self), self.source, self.index,
+                        self.tree_keys, self.lazy)
+
+    def __reduce__(self):
+        return (LazyData, (dict(self), self.source, self.index,
+                           self.tree_keys, self.lazy,))
+
+
+def _loading(name):
+    method = getattr(dict, name)
+
+    def wrapper(self, *args):
+        self.load()
+        return method(self, *args)
+    wrapper.__name__ = name
+    return wrapper
+
+for name in ('__iter__', '__len__', '__eq__', '__ne__', '__cmp__',
+             '__repr__', '__delitem__', 'keys', 'values', 'items',
+             'iterkeys', 'itervalues', 'iteritems', 'viewkeys', 'viewvalues',
+             'viewitems', 'pop', 'popitem', 'clear',):
+    if hasattr(dict, name):
+        setattr(LazyData, name, _loading(name))
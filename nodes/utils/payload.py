@@ -0,0 +1,65 @@
+"""
+Encoded cache payloads: pickled value is compressed (zlib) if it is larger
+than threshold and split into chunks (separate cache entries) if it is
+still larger than chunk size (e.g. memcached item size limit).
+
+Main entry value is encoded value itself or chunks header, so not encoded
+values (saved without encoding) are also readable.
+"""
+import hashlib
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+PAYLOAD = 'nodes.payload'
+CHUNKS = 'nodes.chunks'
+
+
+def chunk_key(key, number):
+    return '%s_chunk%d' % (key, number)
+
+
+def encode(key, value, threshold=None, chunk_size=None):
+    """
+    Encode value, returns ({key: entry value, ...}, sizes), where sizes is
+    (raw, encoded, chunks count) tuple.
+    """
+    data = pickle.dumps(value, 2)
+    raw, compressed = len(data), bool(threshold and len(data) >= threshold)
+    if compressed:
+        data = zlib.compress(data)
+
+    if not chunk_size or len(data) <= chunk_size:
+        return {key: (PAYLOAD, compressed, data,)}, (raw, len(data), 0,)
+
+    chunks = [data[i:i+chunk_size] for i in range(0, len(data), chunk_size)]
+    values = dict((chunk_key(key, i), chunk) for i, chunk in enumerate(chunks))
+    values[key] = (CHUNKS, compressed, len(chunks),
+                   hashlib.md5(data).hexdigest(),)
+    return values, (raw, len(data), len(chunks),)
+
+
+def decode(key, value, get_many):
+    """
+    Decode entry value of key, get_many is used to get chunks values.
+    Returns None if value or any its chunk is missing or invalid.
+    """
+    if not isinstance(value, tuple) or not value or value[0] not in (
+            PAYLOAD, CHUNKS,):
+        return value
+
+    if value[0] == PAYLOAD:
+        data = value[2]
+    else:
+        keys = [chunk_key(key, i) for i in range(value[2])]
+        chunks = get_many(keys)
+        if len(chunks) != len(keys):
+            return None
+        data = b''.join(chunks[i] for i in keys)
+        if hashlib.md5(data).hexdigest() != value[3]:
+            return None
+
+    return pickle.loads(zlib.decompress(data) if value[1] else data)
@@ -0,0 +1,71 @@
+"""
+Background nodes rebuild by models changes.
+
+Menus are linked to models with Registry.register_signals, any post_save
+or post_delete of linked model schedules rebuild of menuconfs, which
+contain changed menu. Changes are debounced: rebuild starts after
+REBUILD_DELAY seconds without new changes (but not later than 10 delays
+after first one), so bulk updates cause single rebuild. Rebuilds never
+overlap: changes during rebuild are scheduled after it ends.
+
+Rebuild runs in worker thread: new nodes data is built, stored in cache
+under new version key and only then version pointer is replaced, so
+requests always read consistent data and never wait for rebuild.
+"""
+import threading
+import time
+from django.db import connections
+
+
+class Rebuilder(object):
+    """Debounced background rebuilder of menuconfs nodes."""
+
+    max_delays = 10
+
+    def __init__(self, processor, delay):
+        self.processor = processor
+        self.delay = delay
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.timer = None
+        self.started = None
+        self.running = False
+
+    def schedule(self, names):
+        """Schedule rebuild of menuconfs (by names)."""
+        with self.lock:
+            self.pending.update(names)
+            # running rebuild schedules pending menuconfs after it ends
+            if not self.running:
+                self.start_timer()
+
+    def start_timer(self):
+        """Start or postpone debounce timer (called under lock)."""
+        now = time.time()
+        if self.timer:
+            # do not postpone rebuild forever on continuous changes
+            if now - self.started >= self.delay * self.max_delays:
+                return
+            self.timer.cancel()
+        else:
+            self.started = now
+        self.timer = threading.Timer(self.delay, self.run)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def run(self):
+        with self.lock:
+            # timer fired after cancel or during rebuild, skip it
+            if self.running or not self.pending:
+                return
+            names, self.pending, self.timer = self.pending, set(), None
+            self.running = True
+        try:
+            for name in sorted(names):
+                self.processor.rebuild(name)
+        finally:
+            connections.close_all()
+            with self.lock:
+                self.running = False
+                if self.pending:
+                    self.start_timer()
@@ -0,0 +1,97 @@
+"""
+Compiled menu renderer - alternative to recursive menu templates.
+
+Menu markup is described by small declarative spec - dict (used for any
+level) or list of dicts (per level, last one is used for deeper levels):
+    {
+        'list_start': u'<ul>',
+        'list_end': u'</ul>',
+        'item_start': u'<li class="{classes}"><a href="{url}">{title}</a>',
+        'item_end': u'</li>',
+    }
+"item_start" is formatted with escaped "url" and "title", "classes"
+(space separated "selected", "ancestor", "sibling", "descendant" and "leaf"
+marks from nodes state) and "level" values. Spec is compiled once into
+a function, which writes html for the nodes tree in one iterative pass.
+"""
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+from .. import settings as msettings
+
+
+DEFAULT_SPEC = {
+    'list_start': u'<ul>',
+    'list_end': u'</ul>',
+    'item_start': u'<li class="{classes}"><a href="{url}">{title}</a>',
+    'item_end': u'</li>',
+}
+
+_compiled = {}
+
+
+def compile_menu(spec):
+    """Compile spec into render(nodes, state) function."""
+    levels = [dict(DEFAULT_SPEC, **level) for level in
+              (spec if isinstance(spec, (list, tuple,)) else [spec])]
+    levels = [(i['list_start'], i['list_end'],
+               i['item_start'].format, i['item_end'],) for i in levels]
+    depth = len(levels) - 1
+
+    def render(nodes, state):
+        if not nodes:
+            return mark_safe(u'')
+
+        selected, hidden = state.selected, state.hidden
+        leaf, sibling = state.is_leaf, state.is_sibling
+        ancestor, descendant = state.is_ancestor, state.is_descendant
+        urls, escape = state.urls, conditional_escape
+
+        output = [levels[0][0]]
+        stack = [(iter(nodes), levels[0],)]
+        while stack:
+            items, level = stack[-1]
+            node = next(items, None)
+            if node is None:
+                stack.pop()
+                output.append(level[1])
+                stack and output.append(stack[-1][1][3])
+                continue
+            if node.index in hidden:
+                continue
+
+            index = node.index
+            classes = u' '.join([name for name, value in (
+                ('selected', index is not None and index == selected),
+                ('ancestor', ancestor(index)),
+                ('sibling', sibling(index)),
+                ('descendant', descendant(index)),
+                ('leaf', leaf(index)),
+            ) if value])
+            output.append(level[2](
+                url=escape(urls.get(index, node.url)),
+                title=escape(node.title), classes=classes,
+                level=len(stack) - 1))
+
+            children = ([i for i in node.children if i.index not in hidden]
+                        if node.children and hidden else node.children)
+            if children:
+                child = levels[min(len(stack), depth)]
+                output.append(child[0])
+                stack.append((iter(children), child,))
+            else:
+                output.append(level[3])
+        return mark_safe(u''.join(output))
+
+    return render
+
+
+def get_menu_renderer(name=None):
+    """Get compiled renderer by spec name from MENUS_RENDER_SPECS setting."""
+    name = name or 'default'
+    render = _compiled.get(name, None)
+    if render is None:
+        spec = msettings.RENDER_SPECS.get(name, None)
+        if spec is None and name != 'default':
+            raise ValueError('Menus render spec invalid name (%s).' % name)
+        render = _compiled[name] = compile_menu(spec or DEFAULT_SPEC)
+    return render
@@ -0,0 +1,150 @@
+"""
+Replay load test: requests from access log like file are processed by
+menus (router, get_nodes and template tags) in several threads, result
+is throughput, latency percentiles, cache hit rates and nodes builds count,
+so different configurations (CACHE_TIMEOUT, modifiers groups, tree sizes)
+can be compared before deployment.
+
+File format - one request per line: path, auth flag (0 or 1, optional)
+and language (optional), empty lines and lines started with "#" are
+ignored, e.g.:
+    /news/ 0 en
+    /news/2/ 1 de
+Usage (in shell of project with configured menus):
+    from nodes.utils.replay import replay
+    replay('paths.log', threads=8, cache='locmem')
+"""
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache.backends.locmem import LocMemCache
+from django.template import Context, Template
+from django.test import RequestFactory
+from django.utils.translation import override
+from .trace import Trace
+
+
+TEMPLATE = '{% load menu_tags %}{% show_menu %}'
+
+
+def read_requests(source):
+    """Read (path, auth, lang) requests from filename or lines iterable."""
+    if isinstance(source, basestring):
+        with open(source) as lines:
+            return read_requests(lines.readlines())
+
+    requests = []
+    for line in source:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        values = line.split()
+        requests.append((values[0],
+                         len(values) > 1 and values[1] not in ('0', '-',),
+                         values[2] if len(values) > 2 else None,))
+    return requests
+
+
+class CountingCache(object):
+    """Cache wrapper with gets and hits counters."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.gets = self.hits = 0
+
+    def count(self, gets, hits):
+        with self.lock:
+            self.gets, self.hits = self.gets + gets, self.hits + hits
+
+    def get(self, key, default=None, **kwargs):
+        value = self.cache.get(key, default, **kwargs)
+        self.count(1, int(value is not default))
+        return value
+
+    def get_many(self, keys, **kwargs):
+        values = self.cache.get_many(keys, **kwargs)
+        self.count(len(keys), len(values))
+        return values
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+
+def percentile(values, value):
+    return values[min(len(values) - 1, int(len(values) * value))]
+
+
+def replay(source, threads=4, template=TEMPLATE, cache=None, repeat=1):
+    """
+    Replay requests (see read_requests) in threads, each request is
+    processed by template (rendered with request in context). Cache is
+    processor cache by default or "locmem" for empty stand-in cache (it is
+    set to processor only while replaying).
+    Returns dict with "requests", "errors", "seconds", "rps", "p50", "p99"
+    (latency in seconds), "cache_hit_rate" (cache gets), "nodes_hit_rate"
+    (nodes loading from cache), "builds" and "rebuilds" (rebuild loops).
+    """
+    from .. import registry
+    requests = read_requests(source) * repeat
+    template = Template(template)
+    user = User(username='replay')
+    language = settings.LANGUAGE_CODE
+
+    processor = registry.processor
+    original = processor.cache
+    counter = processor.cache = CountingCache(
+        LocMemCache('nodes-replay', {}) if cache == 'locmem' else original)
+
+    lock, results = threading.Lock(), []
+
+    def worker(items):
+        factory, values = RequestFactory(), []
+        for path, auth, lang in items:
+            request = factory.get(path)
+            request.user = user if auth else AnonymousUser()
+            start = time.time()
+            try:
+                with override(lang or language):
+                    processor.add_nodes_to_request(request)
+                    request.nodes.trace = Trace()
+                    template.render(Context({'request': request,}))
+            except Exception:
+                values.append((time.time() - start, None,))
+                continue
+            values.append((time.time() - start, request.nodes.trace,))
+        with lock:
+            results.extend(values)
+
+    workers = [threading.Thread(target=worker, args=(requests[i::threads],))
+               for i in range(threads)]
+    start = time.time()
+    try:
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    finally:
+        processor.cache = original
+    seconds = time.time() - start
+
+    latency = sorted(i[0] for i in results)
+    entries = [entry for duration, trace in results if trace
+               for entry in trace.menus.values()]
+    loaded = [i for i in entries if i['cache']]
+    return {
+        'requests': len(results),
+        'errors': len([i for i in results if i[1] is None]),
+        'seconds': seconds,
+        'rps': len(results) / seconds if seconds else None,
+        'p50': percentile(latency, .5) if latency else None,
+        'p99': percentile(latency, .99) if latency else None,
+        'cache_hit_rate': (float(counter.hits) / counter.gets
+                           if counter.gets else None),
+        'nodes_hit_rate': (float(len([i for i in loaded
+                                      if i['cache'] == 'hit'])) / len(loaded)
+                           if loaded else None),
+        'builds': len([i for i in loaded if i['cache'] == 'miss']),
+        'rebuilds': sum(i['rebuilds'] for i in entries),
+    }
@@ -0,0 +1,120 @@
+"""
+Shared nodes tree file cache for prefork workers (lazily unpickled).
+
+One process writes indexed (ONCE) nodes data into file in branch storage
+format (see utils.branches), workers map it into memory (mmap) and get
+lazy nodes data from it. Nodes are not read in place: file keeps pickled
+values, each worker unpickles head (roots and lookups) on loading and
+each top-level branch on its first access into own nodes objects. So
+file only replaces cache reads of whole nodes payload by each worker
+(and decoding of not used branches), memory of loaded nodes is not
+shared and grows with workers count.
+
+Layout (little-endian):
+    header:   magic, branches count, version length, head length
+    version:  version bytes (padded to 4)
+    offsets:  branches offsets - uint32[count+1]
+    head:     pickled head value (see branches.split_nodes)
+    branches: pickled branches values
+"""
+import mmap
+import os
+import struct
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from .branches import load_nodes, split_nodes
+
+
+MAGIC = b'NODESMM2'
+HEADER = struct.Struct('<8sIII')
+
+
+def _padded(value):
+    return value + b'\0' * (-len(value) % 4)
+
+
+def _offsets(count):
+    return struct.Struct('<%dI' % (count + 1))
+
+
+def write_tree(path, version, data):
+    """Write indexed nodes data into file (atomic replace)."""
+    version = version.encode('utf8')
+    head, branches = split_nodes(data)
+    head = pickle.dumps(head, 2)
+    offsets = [0]
+    for branch in branches:
+        offsets.append(offsets[-1] + len(branch))
+
+    chunks = [HEADER.pack(MAGIC, len(branches), len(version), len(head)),
+              _padded(version), _offsets(len(branches)).pack(*offsets),
+              head]
+    chunks.extend(branches)
+
+    handle, temp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix='.nodes')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.rename(temp, path)
+    except:
+        os.path.exists(temp) and os.remove(temp)
+        raise
+
+
+class SharedTree(object):
+    """
+    Memory-mapped nodes tree file reader, values are unpickled on load
+    and branch fetch. Map is closed by close or when loaded nodes data
+    (its branches fetcher) is released.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, count, vlength, hlength = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC:
+                raise ValueError('Invalid nodes tree file (%s).' % path)
+
+            offset = HEADER.size
+            self.version = self.map[offset:offset+vlength].decode('utf8')
+            offset += len(_padded(b'\0' * vlength))
+            self.offsets = _offsets(count).unpack_from(self.map, offset)
+            self._head = offset + _offsets(count).size
+            self._branches = self._head + hlength
+            if len(self.map) != self._branches + self.offsets[-1]:
+                raise ValueError('Truncated nodes tree file (%s).' % path)
+        except:
+            self.close()
+            raise
+
+    @classmethod
+    def open(cls, path, version=None):
+        """Open file if it exists and has required version, else None."""
+        try:
+            tree = cls(path)
+        except (IOError, OSError, ValueError, struct.error):
+            return None
+        if version is not None and tree.version != version:
+            tree.close()
+            return None
+        return tree
+
+    def close(self):
+        self.map.close()
+
+    def branch(self, position):
+        """Get stored branch value by root position."""
+        start = self._branches + self.offsets[position]
+        return self.map[start:self._branches + self.offsets[position+1]]
+
+    def load(self):
+        """Get lazy nodes data, branches are fetched from map on access."""
+        head = pickle.loads(self.map[self._head:self._branches])
+        return load_nodes(head, lambda positions: [self.branch(i)
+                                                   for i in positions])
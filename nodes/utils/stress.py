@@ -0,0 +1,84 @@
+"""
+Multithreaded stress check of nodes processing.
+
+Each path is processed once in main thread to get expected result, then
+worker threads process random paths concurrently and compare results
+(menuconf, selection, nodes and urls) with expected ones. Every request
+processes routed menuconf and other menuconfs (all by default) in random
+order, as templates with several menus do.
+Usage (in shell of project with configured menus):
+    from nodes.utils.stress import stress
+    stress(['/', '/news/', '/news/2/', '/about/'], threads=8, requests=2000)
+"""
+import random
+import threading
+import time
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from . import tgenerator
+
+
+def signature(processor, request, name, nodes):
+    """Comparable value of request nodes processing result."""
+    conf, state = processor.menuconf(request, name=name), nodes['state']
+    return (conf['NAME'], conf['SELECTED'], state.selected,
+            tuple((i.index, state.get_url(i),)
+                  for i in tgenerator(nodes['nodes'])),)
+
+
+def process(processor, path, user=None, menuconfs=(), **kwargs):
+    """Process routed (None key) and menuconfs nodes in one request."""
+    request = RequestFactory().get(path)
+    request.user = user or AnonymousUser()
+    result = {}
+    for name in (None,) + tuple(menuconfs):
+        nodes = processor.get_nodes(name, request, **kwargs)
+        result[name] = signature(processor, request, name, nodes)
+    return result
+
+
+def stress(paths, threads=8, requests=1000, user=None, seed=0,
+           menuconfs=None, **kwargs):
+    """
+    Run stress check, returns dict with "requests", "errors" count,
+    "failures" (first ten (path, error) values), "seconds" and "rps".
+    Each request processes menuconfs (all names by default) besides routed
+    one. Keyword arguments are passed to get_nodes (modifiers, ect).
+    """
+    from .. import registry, settings as msettings
+    processor = registry.processor
+    menuconfs = sorted(msettings.MENUS) if menuconfs is None else menuconfs
+    expected = dict((path, process(processor, path, user, menuconfs,
+                                   **kwargs),)
+                    for path in paths)
+    lock, failures, counts = threading.Lock(), [], [0]
+
+    def worker(number, count):
+        rnd, errors = random.Random(seed + number), []
+        names = list(menuconfs)
+        for i in range(count):
+            path = rnd.choice(paths)
+            rnd.shuffle(names)
+            try:
+                if (process(processor, path, user, names, **kwargs) !=
+                        expected[path]):
+                    errors.append((path, 'unexpected result',))
+            except Exception as e:
+                errors.append((path, repr(e),))
+        with lock:
+            counts[0] += len(errors)
+            failures.extend(errors[:10 - len(failures)])
+
+    count = max(1, requests // threads)
+    workers = [threading.Thread(target=worker, args=(i, count,))
+               for i in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    seconds = time.time() - start
+
+    return {'requests': count * threads, 'errors': counts[0],
+            'failures': failures, 'seconds': seconds,
+            'rps': count * threads / seconds if seconds else None,}
@@ -0,0 +1,59 @@
+"""
+Per-request menus processing trace (see middleware.MenusTraceMiddleware).
+
+Trace is collected by processor only if request.nodes.trace is set: each
+touched menuconf gets entry with cache status ("hit", "miss" or None if
+nodes were already loaded in request), build time, rebuild loop count,
+DEFAULT stage copies count, total get_nodes time and modifiers durations.
+"""
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+
+class Trace(object):
+    """Menus processing trace of single request."""
+
+    def __init__(self):
+        self.menus = OrderedDict()
+
+    def menu(self, name):
+        entry = self.menus.get(name, None)
+        if entry is None:
+            entry = self.menus[name] = {
+                'cache': None, 'build': 0.0, 'rebuilds': 0, 'copies': 0,
+                'calls': 0, 'time': 0.0, 'modifiers': OrderedDict(),}
+        return entry
+
+    def as_dict(self):
+        return OrderedDict(self.menus)
+
+    def server_timing(self):
+        """Server-Timing header value (durations in milliseconds)."""
+        metrics = []
+        for name, entry in self.menus.items():
+            prefix = 'menus-%s' % re.sub(r'[^\w-]', '_', name)
+            metrics.append('%s;dur=%.3f;desc="%s calls=%d rebuilds=%d'
+                           ' copies=%d"' % (prefix, entry['time'] * 1000,
+                                            entry['cache'] or 'request',
+                                            entry['calls'], entry['rebuilds'],
+                                            entry['copies'],))
+            if entry['build']:
+                metrics.append('%s-build;dur=%.3f' % (prefix,
+                                                      entry['build'] * 1000,))
+            for modifier, value in entry['modifiers'].items():
+                metrics.append('%s-%s;dur=%.3f' % (prefix, modifier,
+                                                   value * 1000,))
+        return ', '.join(metrics)
+
+    def dump(self, path, request_path):
+        """Save trace as json file into path directory, returns filename."""
+        filename = os.path.join(path, '%s-%s.json' % (
+            '%.6f' % time.time(),
+            re.sub(r'[^\w-]', '_', request_path.strip('/')) or 'index',))
+        with open(filename, 'w') as f:
+            json.dump({'path': request_path, 'menus': self.as_dict(),}, f,
+                      indent=2)
+        return filename
@@ -0,0 +1,202 @@
+import json
+from itertools import chain, islice
+from xml.sax.saxutils import escape
+from django.http import (Http404, HttpResponseNotModified,
+                         StreamingHttpResponse)
+from django.utils.cache import patch_vary_headers
+from . import registry
+
+
+def node_to_json(node, state):
+    """Node values for json export (without children)."""
+    return {
+        'id': node.id,
+        'namespace': node.namespace,
+        'title': node.title,
+        'url': state.get_url(node),
+        'visible': node.visible,
+        'selected': node.index is not None and node.index == state.selected,
+    }
+
+
+def iter_json(nodes, state, serializer=node_to_json, chunk_size=200):
+    """
+    Stream nodes tree as json list of nodes with "children" key,
+    iterative traversal, output yielded by chunks of chunk_size nodes.
+    """
+    encode = json.JSONEncoder(ensure_ascii=False,
+                              separators=(',', ':',)).encode
+    hidden, output, count = state.hidden, [u'['], 0
+    stack = [[iter([i for i in nodes if i.index not in hidden]), True]]
+    while stack:
+        items = stack[-1]
+        node = next(items[0], None)
+        if node is None:
+            stack.pop()
+            output.append(u']}' if stack else u']')
+            continue
+
+        # first item in list or comma separated
+        if items[1]:
+            items[1] = False
+        else:
+            output.append(u',')
+        output.append(encode(serializer(node, state))[:-1] +
+                      u',"children":[')
+        stack.append([iter(state.children(node)), True])
+
+        count += 1
+        if count >= chunk_size:
+            yield u''.join(output).encode('utf8')
+            output, count = [], 0
+    yield u''.join(output).encode('utf8')
+
+
+def etag_matches(etag, header):
+    """
+    Check If-None-Match header value (comma separated list of tags or "*")
+    against etag, weak tags (W/"...") are compared by their values.
+    """
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == etag:
+            return True
+    return False
+
+
+def get_menuconf(request, menuconf, modifiers=None):
+    """Get menuconf value, raise Http404 if menuconf or modifiers unknown."""
+    try:
+        conf = registry.processor.menuconf(request, name=menuconf)
+    except ValueError:
+        raise Http404('Unknown menuconf.')
+    if modifiers and modifiers not in conf['MODIFIERS']:
+        raise Http404('Unknown modifiers group.')
+    return conf
+
+
+def menu_json(request, menuconf=None, modifiers=None):
+    """
+    Export menuconf nodes as streamed json.
+    If modifiers group is not defined, PER_REQUEST nodes tree is exported,
+    else DEFAULT one with requested modifiers group. Response has ETag
+    by nodes version and visibility class and unchanged nodes are returned
+    as 304 without loading at all.
+    Usage: url(r'^menu/(?P<menuconf>\\w+)\\.json$', menu_json),
+    """
+    processor = registry.processor
+    conf = get_menuconf(request, menuconf, modifiers)
+    etag = processor.get_etag(request, conf, modifiers)
+    if etag and etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    if modifiers:
+        nodes = processor.get_nodes(conf, request, modifiers=modifiers,
+                                    readonly=True)
+    else:
+        processor.get_nodes(conf, request, init_only=True)
+        nodes = request.nodes.menus[conf['NAME']]
+
+    response = StreamingHttpResponse(iter_json(nodes['nodes'], nodes['state']),
+                                     content_type='application/json')
+    etag = etag or processor.get_etag(request, conf, modifiers)
+    if etag:
+        response['ETag'] = etag
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def iter_sitemap_urls(nodes, get_path):
+    """
+    Iterate sitemap urls of ONCE nodes data by iterative traversal:
+    subtrees of auth required nodes and invisible nodes are skipped, url
+    of each path is yielded once (by node selected for path in "paths").
+    """
+    paths, root = nodes.get('paths', None) or {}, False
+    stack = [iter(nodes['nodes'])]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            continue
+        if node.data.get('auth_required', False):
+            continue
+        if node.children:
+            stack.append(iter(node.children))
+        if not node.visible:
+            continue
+
+        path = get_path(node)
+        if path is None or (paths.get(path, None) is not node if path else
+                            root):
+            continue
+        root = root or not path
+        yield node.url_original
+
+
+def iter_sitemap(urls, build_url, index=False, chunk_size=200):
+    """
+    Stream sitemap (urlset) or sitemap index (if index) xml of urls,
+    output yielded by chunks of chunk_size urls.
+    """
+    tag = 'sitemap' if index else 'url'
+    output = [u'<?xml version="1.0" encoding="UTF-8"?>\n<%s xmlns='
+              u'"http://www.sitemaps.org/schemas/sitemap/0.9">' % (
+                  'sitemapindex' if index else 'urlset')]
+    for count, url in enumerate(urls, 1):
+        output.append(u'<%s><loc>%s</loc></%s>' % (tag, escape(build_url(url)),
+                                                   tag,))
+        if not count % chunk_size:
+            yield u''.join(output).encode('utf8')
+            output = []
+    output.append(u'</%s>' % ('sitemapindex' if index else 'urlset'))
+    yield u''.join(output).encode('utf8')
+
+
+def sitemap(request, menuconf=None, limit=50000):
+    """
+    Stream sitemap.xml of menuconf ONCE nodes (cached or built) urls.
+    If urls count is greater than limit, sitemap index is returned with
+    pages urls (?p=1, ?p=2, ...), each page is sitemap of limit urls.
+    Nodes are traversed iteratively and output is streamed, so memory
+    usage does not depend on urls count.
+    Usage: url(r'^sitemap\\.xml$', sitemap),
+    """
+    processor = registry.processor
+    conf = get_menuconf(request, menuconf)
+    cache_key = processor.cache_key(request=request, menuconf=conf)
+    nodes = (processor.get_cached_nodes(conf, cache_key) or
+             processor.create_nodes(conf, request, cache_key))
+
+    def urls():
+        return iter_sitemap_urls(nodes, processor.get_path)
+
+    page = request.GET.get('p', None)
+    if page is None:
+        count = sum(1 for i in urls())
+        if count > limit:
+            pages = (u'?p=%d' % i for i in range(1, (count - 1) // limit + 2))
+            return StreamingHttpResponse(
+                iter_sitemap(pages, request.build_absolute_uri, index=True),
+                content_type='application/xml')
+        items = urls()
+    else:
+        try:
+            page = int(page)
+        except ValueError:
+            raise Http404('Invalid sitemap page.')
+        if page < 1:
+            raise Http404('Invalid sitemap page.')
+        items = islice(urls(), (page - 1) * limit, page * limit)
+        # page after the last one (first page of empty sitemap is valid)
+        first = next(items, None)
+        if first is None and page > 1:
+            raise Http404('Invalid sitemap page.')
+        items = chain((first,), items) if first is not None else items
+
+    return StreamingHttpResponse(
+        iter_sitemap(items, request.build_absolute_uri),
+        content_type='application/xml')